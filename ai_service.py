@@ -1,55 +1,123 @@
-import requests
 import os
 import random
+import threading
+import time
 from datetime import date, datetime, timedelta
-# Import inside functions to avoid circular import
+
+import metrics
+import tracing
+from extensions import db
+from models import Anniversary, Moment
+
+class TokenBucket:
+    """线程安全的令牌桶，用于限制对百炼 API 的请求速率"""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """收到 429 时清空令牌并暂停所有调用方"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
 
 class LoveOneDayService:
+    # Optional TokenBucket shared by every caller of call_bailian_api (set by batch jobs)
+    rate_limiter = None
     
     @staticmethod
-    def collect_daily_data():
-        """收集今日播报所需的数据"""
-        # Import here to avoid circular import
-        from app import app, db, Anniversary, Moment
-        today = date.today()
+    def collect_daily_data(target_date=None):
+        """收集指定日期（默认今天）播报所需的数据（需在应用上下文中调用）"""
+        with tracing.span('love_one_day.collect_daily_data') as span:
+            today = target_date or date.today()
         
-        # Use app context to query the database
-        with app.app_context():
             # 检查今天是否是纪念日
             # Use extract function to get day and month from the date column
-            today_anniversaries = Anniversary.query.filter(
-                db.extract('day', Anniversary.date) == today.day,
-                db.extract('month', Anniversary.date) == today.month
-            ).all()
-            
+            with tracing.span('love_one_day.query_anniversaries'):
+                today_anniversaries = Anniversary.query.filter(
+                    db.extract('day', Anniversary.date) == today.day,
+                    db.extract('month', Anniversary.date) == today.month
+                ).all()
+        
             # 检查往年当天是否有超过3条日常
             historical_moments = []
-            for year in range(2020, today.year):  # 假设从2020年开始有数据
-                try:
-                    historical_date = date(year, today.month, today.day)
-                    moments_on_date = Moment.query.filter(
-                        db.extract('day', Moment.timestamp) == historical_date.day,
-                        db.extract('month', Moment.timestamp) == historical_date.month
-                    ).all()
+            start_of_day = datetime.combine(today, datetime.min.time())
+            with tracing.span('love_one_day.query_historical_moments', years=max(0, today.year - 2020)):
+                for year in range(2020, today.year):  # 假设从2020年开始有数据
+                    try:
+                        historical_date = date(year, today.month, today.day)
+                        moments_on_date = Moment.query.options(
+                            db.joinedload(Moment.user)
+                        ).filter(
+                            db.extract('day', Moment.timestamp) == historical_date.day,
+                            db.extract('month', Moment.timestamp) == historical_date.month,
+                            # a backfilled date must not "remember" moments posted after it
+                            Moment.timestamp < start_of_day
+                        ).all()
                     
-                    if len(moments_on_date) >= 3:
-                        historical_moments.extend(moments_on_date)
-                except ValueError:
-                    # 忽略无效日期（如2月29日）
-                    continue
-            
+                        if len(moments_on_date) >= 3:
+                            historical_moments.extend(moments_on_date)
+                    except ValueError:
+                        # 忽略无效日期（如2月29日）
+                        continue
+        
             # 获取最近的动态（过去3天内）
-            three_days_ago = datetime.now() - timedelta(days=3)
-            recent_moments = Moment.query.filter(
-                Moment.timestamp >= three_days_ago
-            ).order_by(Moment.timestamp.desc()).limit(10).all()
+            reference_time = datetime.combine(today, datetime.now().time())
+            three_days_ago = reference_time - timedelta(days=3)
+            with tracing.span('love_one_day.query_recent_moments'):
+                recent_moments = Moment.query.options(
+                    db.joinedload(Moment.user)
+                ).filter(
+                    Moment.timestamp >= three_days_ago,
+                    Moment.timestamp <= reference_time
+                ).order_by(Moment.timestamp.desc()).limit(10).all()
         
-        return {
-            'today': today,
-            'today_anniversaries': today_anniversaries,
-            'historical_moments': historical_moments,
-            'recent_moments': recent_moments
-        }
+            span.set_attributes(**{
+                'report.date': today.isoformat(),
+                'anniversaries': len(today_anniversaries),
+                'historical_moments': len(historical_moments),
+                'recent_moments': len(recent_moments),
+            })
+            return {
+                'today': today,
+                'today_anniversaries': today_anniversaries,
+                'historical_moments': historical_moments,
+                'recent_moments': recent_moments
+            }
+    
+    @staticmethod
+    def get_broadcast_type(data):
+        """根据收集到的数据判断播报类型"""
+        if data['today_anniversaries']:
+            return 'anniversary'
+        if data['historical_moments']:
+            return 'historical_moments'
+        return 'historical_events'
     
     @staticmethod
     def get_historical_events(month, day):
@@ -82,7 +150,7 @@ class LoveOneDayService:
     @staticmethod
     def call_bailian_api(prompt, system_prompt=None):
         """调用阿里百炼API"""
-        import time
+        import requests  # only needed when a broadcast is actually generated
         api_key = os.getenv('BAILIAN_API_KEY')
         # Using the DashScope API endpoint for Qwen models
         endpoint = os.getenv('BAILIAN_ENDPOINT', 'https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions')
@@ -108,76 +176,120 @@ class LoveOneDayService:
         
         # Retry logic with exponential backoff
         max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Add timeout for the request
-                response = requests.post(endpoint, headers=headers, json=payload, timeout=30)
-                
-                if response.status_code == 429:  # Rate limited
-                    wait_time = (2 ** attempt) + 1  # Exponential backoff
-                    print(f"Rate limited, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                    time.sleep(wait_time)
-                    continue
-                elif response.status_code >= 400:
-                    print(f"BaiLian API Error {response.status_code}: {response.text}")
-                    if attempt == max_retries - 1:  # Last attempt
+        limiter = LoveOneDayService.rate_limiter
+        with tracing.span('bailian.chat_completions', kind=tracing.KIND_CLIENT,
+                          **{'llm.model': payload['model'], 'max_retries': max_retries}):
+            for attempt in range(max_retries):
+                if attempt > 0:
+                    metrics.LLM_RETRIES.inc()
+                with tracing.span('bailian.attempt', attempt=attempt + 1) as span:
+                    try:
+                        if limiter:
+                            with tracing.span('bailian.rate_limiter_wait'):
+                                limiter.acquire()
+                        # Add timeout for the request
+                        started = time.perf_counter()
+                        try:
+                            response = requests.post(endpoint, headers=headers, json=payload, timeout=30)
+                        except requests.exceptions.Timeout:
+                            metrics.LLM_LATENCY.observe(time.perf_counter() - started, 'timeout')
+                            raise
+                        except requests.exceptions.RequestException:
+                            metrics.LLM_LATENCY.observe(time.perf_counter() - started, 'error')
+                            raise
+                        metrics.LLM_LATENCY.observe(time.perf_counter() - started, str(response.status_code))
+                        span.set_attribute('http.response.status_code', response.status_code)
+                        
+                        if response.status_code == 429:  # Rate limited
+                            metrics.LLM_RATE_LIMITED.inc()
+                            wait_time = (2 ** attempt) + 1  # Exponential backoff
+                            retry_after = response.headers.get('Retry-After')
+                            if retry_after and retry_after.isdigit():
+                                wait_time = max(wait_time, int(retry_after))
+                            print(f"Rate limited, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
+                            span.set_error('rate limited')
+                            if limiter:
+                                # Hold back the other workers too instead of letting them hit 429
+                                limiter.pause(wait_time)
+                            with tracing.span('bailian.backoff', wait_seconds=wait_time, reason='rate_limited'):
+                                time.sleep(wait_time)
+                            continue
+                        elif response.status_code >= 400:
+                            print(f"BaiLian API Error {response.status_code}: {response.text}")
+                            span.set_error(f'HTTP {response.status_code}')
+                            if attempt == max_retries - 1:  # Last attempt
+                                response.raise_for_status()
+                            continue
+                        
                         response.raise_for_status()
-                    continue
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                if 'choices' in result and len(result['choices']) > 0:
-                    content = result['choices'][0]['message']['content'].strip()
-                    content_length = len(content)
-                    
-                    if content_length > 350:
-                        print(f"Warning: Generated content length ({content_length}) exceeds recommended limit (350)")
-                    elif content_length < 150:
-                        print(f"Warning: Generated content length ({content_length}) is below recommended minimum (150)")
-                    
-                    return content
-                else:
-                    raise Exception(f"Unexpected API response format: {result}")
-                    
-            except requests.exceptions.Timeout:
-                print(f"BaiLian API Request Timeout (attempt {attempt + 1}/{max_retries})")
-                if attempt == max_retries - 1:
-                    raise
-            except requests.exceptions.RequestException as e:
-                print(f"BaiLian API Request Error (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:
-                    raise
-            except Exception as e:
-                print(f"BaiLian API Error (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:
-                    raise
-            # Wait before retrying
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
+                        result = response.json()
+                        
+                        if 'choices' in result and len(result['choices']) > 0:
+                            content = result['choices'][0]['message']['content'].strip()
+                            content_length = len(content)
+                            span.set_attribute('content_length', content_length)
+                            
+                            if content_length > 350:
+                                print(f"Warning: Generated content length ({content_length}) exceeds recommended limit (350)")
+                            elif content_length < 150:
+                                print(f"Warning: Generated content length ({content_length}) is below recommended minimum (150)")
+                            
+                            return content
+                        else:
+                            raise Exception(f"Unexpected API response format: {result}")
+                            
+                    except requests.exceptions.Timeout as e:
+                        print(f"BaiLian API Request Timeout (attempt {attempt + 1}/{max_retries})")
+                        span.record_exception(e)
+                        if attempt == max_retries - 1:
+                            raise
+                    except requests.exceptions.RequestException as e:
+                        print(f"BaiLian API Request Error (attempt {attempt + 1}/{max_retries}): {e}")
+                        span.record_exception(e)
+                        if attempt == max_retries - 1:
+                            raise
+                    except Exception as e:
+                        print(f"BaiLian API Error (attempt {attempt + 1}/{max_retries}): {e}")
+                        span.record_exception(e)
+                        if attempt == max_retries - 1:
+                            raise
+                # Wait before retrying
+                if attempt < max_retries - 1:
+                    with tracing.span('bailian.backoff', wait_seconds=2 ** attempt, reason='retry'):
+                        time.sleep(2 ** attempt)  # Exponential backoff
     
     @staticmethod
-    def generate_love_broadcast(data):
-        """生成爱的一天智能播报"""
+    def generate_love_broadcast(data, allow_fallback=True):
+        """生成爱的一天智能播报
+
+        With allow_fallback=False a failed BaiLian call raises instead of
+        returning the canned fallback text (used by the backfill, which must
+        not store fallback text as the real report).
+        """
         today = data['today']
         
-        # 判断播报类型
-        if data['today_anniversaries']:
-            # 纪念日模式
-            return LoveOneDayService._generate_anniversary_broadcast(data, today)
-        elif data['historical_moments']:
-            # 历史日常模式
-            return LoveOneDayService._generate_historical_moments_broadcast(data, today)
-        else:
-            # 历史趣事模式
-            return LoveOneDayService._generate_historical_events_broadcast(data, today)
+        with tracing.span('love_one_day.generate_broadcast',
+                          broadcast_type=LoveOneDayService.get_broadcast_type(data), fallback=False) as span:
+            # 判断播报类型
+            if data['today_anniversaries']:
+                # 纪念日模式
+                text = LoveOneDayService._generate_anniversary_broadcast(data, today, allow_fallback)
+            elif data['historical_moments']:
+                # 历史日常模式
+                text = LoveOneDayService._generate_historical_moments_broadcast(data, today, allow_fallback)
+            else:
+                # 历史趣事模式
+                text = LoveOneDayService._generate_historical_events_broadcast(data, today, allow_fallback)
+            span.set_attribute('content_length', len(text))
+            return text
     
     @staticmethod
-    def _generate_anniversary_broadcast(data, today):
+    def _generate_anniversary_broadcast(data, today, allow_fallback=True):
         """生成纪念日模式播报"""
-        ann_titles = [ann.title for ann in data['today_anniversaries']]
+        with tracing.span('love_one_day.build_prompt') as span:
+            ann_titles = [ann.title for ann in data['today_anniversaries']]
         
-        prompt = f"""
+            prompt = f"""
 请以非常甜蜜、浪漫的语气，为情侣生成一份纪念日专属播报。
 
 今天是{today.strftime('%Y年%m月%d日')}，同时也是{'和'.join(ann_titles)}！
@@ -193,24 +305,30 @@ class LoveOneDayService:
 【重要要求】生成的播报内容必须严格控制在200-300字之间，确保内容完整、逻辑清晰、表达流畅，不要因为字数限制而截断句子或导致语义不完整。
 """
         
-        system_prompt = "你是一个浪漫甜蜜的助手，专门为情侣生成纪念日播报。语气要非常温柔、甜蜜，多用emoji，让情侣感受到浓浓的爱意。所有回复必须严格控制在200-300字之间。"
+            system_prompt = "你是一个浪漫甜蜜的助手，专门为情侣生成纪念日播报。语气要非常温柔、甜蜜，多用emoji，让情侣感受到浓浓的爱意。所有回复必须严格控制在200-300字之间。"
+            span.set_attribute('prompt_length', len(prompt))
         
         try:
             return LoveOneDayService.call_bailian_api(prompt, system_prompt)
         except Exception as e:
             print(f"BaiLian API Error: {e}")
+            if not allow_fallback:
+                raise
+            metrics.BROADCAST_FALLBACKS.inc('anniversary')
+            tracing.set_attributes(fallback=True)
             return LoveOneDayService._generate_fallback_anniversary_broadcast(data, today)
     
     @staticmethod
-    def _generate_historical_moments_broadcast(data, today):
+    def _generate_historical_moments_broadcast(data, today, allow_fallback=True):
         """生成历史日常模式播报"""
-        # 选择一些历史日常内容用于播报
-        selected_moments = data['historical_moments'][:5]  # 选择前5条
-        moment_summaries = []
-        for moment in selected_moments:
-            moment_summaries.append(f"{moment.user.name}曾说过：{moment.content[:100]}")
+        with tracing.span('love_one_day.build_prompt') as span:
+            # 选择一些历史日常内容用于播报
+            selected_moments = data['historical_moments'][:5]  # 选择前5条
+            moment_summaries = []
+            for moment in selected_moments:
+                moment_summaries.append(f"{moment.user.name}曾说过：{moment.content[:100]}")
         
-        prompt = f"""
+            prompt = f"""
 请以温馨怀旧的语气，为情侣生成一份回顾往年今日美好时光的播报。
 
 今天是{today.strftime('%Y年%m月%d日')}。
@@ -229,20 +347,26 @@ class LoveOneDayService:
 【重要要求】生成的播报内容必须严格控制在200-300字之间，确保内容完整、逻辑清晰、表达流畅，不要因为字数限制而截断句子或导致语义不完整。
 """
         
-        system_prompt = "你是一个温暖怀旧的助手，专门为情侣回顾往昔美好时光。语气要温馨感人，多用emoji，让情侣感受到时间的美好和爱情的珍贵。所有回复必须严格控制在200-300字之间。"
+            system_prompt = "你是一个温暖怀旧的助手，专门为情侣回顾往昔美好时光。语气要温馨感人，多用emoji，让情侣感受到时间的美好和爱情的珍贵。所有回复必须严格控制在200-300字之间。"
+            span.set_attribute('prompt_length', len(prompt))
         
         try:
             return LoveOneDayService.call_bailian_api(prompt, system_prompt)
         except Exception as e:
             print(f"BaiLian API Error: {e}")
+            if not allow_fallback:
+                raise
+            metrics.BROADCAST_FALLBACKS.inc('historical_moments')
+            tracing.set_attributes(fallback=True)
             return LoveOneDayService._generate_fallback_historical_broadcast(data, today)
     
     @staticmethod
-    def _generate_historical_events_broadcast(data, today):
+    def _generate_historical_events_broadcast(data, today, allow_fallback=True):
         """生成历史趣事模式播报"""
-        historical_event = LoveOneDayService.get_historical_events(today.month, today.day)
+        with tracing.span('love_one_day.build_prompt') as span:
+            historical_event = LoveOneDayService.get_historical_events(today.month, today.day)
         
-        prompt = f"""
+            prompt = f"""
 请以轻松有趣、活泼可爱的语气，为情侣生成一份有趣的历史知识播报。
 
 今天是{today.strftime('%Y年%m月%d日')}。
@@ -261,12 +385,17 @@ class LoveOneDayService:
 【重要要求】生成的播报内容必须严格控制在200-300字之间，确保内容完整、逻辑清晰、表达流畅，不要因为字数限制而截断句子或导致语义不完整。
 """
         
-        system_prompt = "你是一个有趣活泼的助手，专门为情侣带来轻松愉快的历史知识。语气要活泼有趣，大量使用emoji，让播报充满乐趣。所有回复必须严格控制在200-300字之间。"
+            system_prompt = "你是一个有趣活泼的助手，专门为情侣带来轻松愉快的历史知识。语气要活泼有趣，大量使用emoji，让播报充满乐趣。所有回复必须严格控制在200-300字之间。"
+            span.set_attribute('prompt_length', len(prompt))
         
         try:
             return LoveOneDayService.call_bailian_api(prompt, system_prompt)
         except Exception as e:
             print(f"BaiLian API Error: {e}")
+            if not allow_fallback:
+                raise
+            metrics.BROADCAST_FALLBACKS.inc('historical_events')
+            tracing.set_attributes(fallback=True)
             return LoveOneDayService._generate_fallback_historical_events_broadcast(data, today)
     
     @staticmethod
@@ -289,9 +418,21 @@ class LoveOneDayService:
     @staticmethod
     def text_to_speech(text, output_file='static/reports/love_one_day_report.mp3'):
         """将文本转换为语音"""
+        started = time.perf_counter()
+        outcome = 'error'
+        span = tracing.start_span('tts.synthesize', text_length=len(text))
         try:
+            endpoint = os.getenv('TTS_ENDPOINT')
+            if endpoint:
+                # OpenAI-compatible /audio/speech service (e.g. ai_stub.py)
+                span.set_attribute('tts.backend', 'http')
+                LoveOneDayService._speech_request(endpoint, text, output_file)
+                outcome = 'ok'
+                return output_file
+            
             # 使用 edge-tts 或其他 TTS 服务
             # 这里以 edge-tts 为例
+            span.set_attribute('tts.backend', 'edge')
             import edge_tts
             import asyncio
             
@@ -300,10 +441,35 @@ class LoveOneDayService:
                 await communicate.save(output_file)
                 return output_file
             
-            return asyncio.run(_convert_to_speech())
+            result = asyncio.run(_convert_to_speech())
+            outcome = 'ok'
+            return result
         except ImportError:
+            outcome = 'unavailable'
             print("edge-tts not installed, skipping TTS generation")
             return None
         except Exception as e:
             print(f"TTS Error: {e}")
-            return None
\ No newline at end of file
+            return None
+        finally:
+            metrics.TTS_LATENCY.observe(time.perf_counter() - started, outcome)
+            span.set_attribute('outcome', outcome)
+            tracing.end_span(span)
+    
+    @staticmethod
+    def _speech_request(endpoint, text, output_file):
+        """Synthesize `text` with an HTTP TTS endpoint into `output_file`"""
+        import requests
+        headers = {'Content-Type': 'application/json'}
+        api_key = os.getenv('TTS_API_KEY')
+        if api_key:
+            headers['Authorization'] = f'Bearer {api_key}'
+        response = requests.post(endpoint, headers=headers, timeout=60, json={
+            'model': os.getenv('TTS_MODEL', 'tts-1'),
+            'voice': os.getenv('TTS_VOICE', 'zh-CN-XiaoxiaoNeural'),
+            'input': text,
+            'response_format': 'mp3',
+        })
+        response.raise_for_status()
+        with open(output_file, 'wb') as f:
+            f.write(response.content)
@@ -0,0 +1,441 @@
+"""Local stand-in for the BaiLian chat API and the TTS service.
+
+Point the app at it to exercise the generation path offline and under
+reproducible load:
+
+    python ai_stub.py --port 8765 --latency 800 --rate-limit-rate 0.1
+    BAILIAN_API_KEY=stub BAILIAN_ENDPOINT=http://127.0.0.1:8765/v1/chat/completions \\
+    TTS_ENDPOINT=http://127.0.0.1:8765/v1/audio/speech python app.py
+
+Endpoints:
+
+- ``POST .../chat/completions``: OpenAI-compatible chat completions, also with
+  ``"stream": true`` (server-sent events). The reply is derived from a hash of
+  the request, so the same prompt always gets the same text.
+- ``POST .../audio/speech``: fake TTS, returns silent MP3 frames whose length
+  grows with the input text.
+- ``GET /stats``: request, 429 and error counts and the peak concurrency, to
+  check retry and queueing behaviour after a run.
+
+Latency (``--latency`` ± ``--jitter``, ``--tts-latency``), 429s
+(``--rate-limit-rate``, or ``--max-concurrency`` exceeded) and errors
+(``--error-rate``) are injected with a seeded RNG, in every mode.
+
+Record and replay:
+
+    python ai_stub.py --record cassette.jsonl \\
+        --upstream https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions
+    python ai_stub.py --replay cassette.jsonl
+
+``--record`` forwards every request (with its Authorization header) to the
+real services and appends the responses to the cassette; ``--replay`` serves
+them back in the recorded order for each distinct request, with the recorded
+latency scaled by ``--replay-speed``. Requests are matched with dates and the
+random historical event masked, so a cassette keeps working on other days;
+``--replay-match sequence`` ignores the request body altogether (other
+moments in the prompt, a changed system prompt) and replays chat and speech
+recordings in order. Requests missing from the cassette get a 404 unless
+``--replay-miss synthetic``.
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT_LENGTH = 240
+MP3_FRAME = b'\xff\xfb\x90\x00' + bytes(413)  # 128 kbps / 44.1 kHz, silent, ~26 ms
+MP3_FRAMES_PER_CHAR = 10
+
+# parts of a prompt that change from day to day (see ai_service.py), masked in request keys
+_VOLATILE = (
+    (re.compile(r'(在历史上的今天，曾发生过这样的事情：\n)[^\n]*'), r'\1<event>'),
+    (re.compile(r'\d{4}年\d{1,2}月\d{1,2}日|\d{4}-\d{2}-\d{2}|\d{1,2}月\d{1,2}日'), '<date>'),
+)
+
+_FILLER = ('今天的阳光刚刚好，像你的笑容一样温暖💕。愿我们把平凡的日子过成诗，'
+           '一起散步、一起做饭、一起看晚霞🌇。谢谢你一直在身边，往后余生请多指教✨。')
+
+
+class StubOptions:
+    def __init__(self, latency_ms=0, jitter_ms=0, tts_latency_ms=0, rate_limit_rate=0.0, retry_after=1,
+                 error_rate=0.0, error_status=500, max_concurrency=0, content_length=DEFAULT_CONTENT_LENGTH,
+                 stream_chunk_chars=8, stream_interval_ms=20, seed=0, mode='synthetic', cassette=None,
+                 upstream=None, tts_upstream=None, replay_speed=1.0, replay_miss='error',
+                 replay_match='request'):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tts_latency_ms = tts_latency_ms
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_concurrency = max_concurrency
+        self.content_length = content_length
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_interval_ms = stream_interval_ms
+        self.seed = seed
+        self.mode = mode
+        self.cassette = cassette
+        self.upstream = upstream
+        self.tts_upstream = tts_upstream
+        self.replay_speed = replay_speed
+        self.replay_miss = replay_miss
+        self.replay_match = replay_match
+
+
+def normalize(value):
+    """`value` with dates and the day's random historical event masked in every string"""
+    if isinstance(value, str):
+        for pattern, replacement in _VOLATILE:
+            value = pattern.sub(replacement, value)
+        return value
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def request_key(kind, body):
+    """Stable key of a request: the normalized JSON body with sorted keys
+
+    Dates and the randomly picked historical event are masked, so a cassette
+    recorded on one day still matches the prompts built on another.
+    """
+    canonical = json.dumps(normalize(body), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(f'{kind}:{canonical}'.encode('utf-8')).hexdigest()
+
+
+def synthetic_reply(key, length):
+    rng = random.Random(key)
+    start = rng.randrange(len(_FILLER))
+    return (_FILLER * (length // len(_FILLER) + 2))[start:start + length]
+
+
+def silent_mp3(text):
+    return MP3_FRAME * max(1, len(text) * MP3_FRAMES_PER_CHAR)
+
+
+class Cassette:
+    """Recorded responses in a JSON-lines file, replayed in order per request key
+
+    With ``match='sequence'`` the key is ignored and each kind of request
+    (chat, speech) gets the recordings of that kind in recorded order.
+    """
+
+    def __init__(self, path, match='request'):
+        self.path = path
+        self.match = match
+        self._lock = threading.Lock()
+        self._recorded = {}
+        self._positions = {}
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recorded.setdefault(self._slot(entry['kind'], entry['key']), []).append(entry)
+        return sum(len(entries) for entries in self._recorded.values())
+
+    def _slot(self, kind, key):
+        return kind if self.match == 'sequence' else key
+
+    def next(self, kind, key):
+        with self._lock:
+            key = self._slot(kind, key)
+            entries = self._recorded.get(key)
+            if not entries:
+                return None
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            # keep serving the last recording once a key's sequence is used up
+            return entries[min(position, len(entries) - 1)]
+
+    def append(self, entry):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        super().__init__(address, StubHandler)
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.cassette = Cassette(options.cassette, options.replay_match) if options.cassette else None
+        if options.mode == 'replay':
+            self.cassette.load()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'replay_misses': 0,
+                      'in_flight': 0, 'peak_in_flight': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve from a daemon thread (for tests and benchmark.py)"""
+        threading.Thread(target=self.serve_forever, name='ai-stub', daemon=True).start()
+        return self
+
+    def enter(self):
+        """Count a request; returns (injected failure status or None, latency jitter in ms)"""
+        options = self.options
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+            roll = self.rng.random()
+            if options.max_concurrency and self.stats['in_flight'] > options.max_concurrency:
+                failure = 429
+            elif roll < options.rate_limit_rate:
+                failure = 429
+            elif roll < options.rate_limit_rate + options.error_rate:
+                failure = options.error_status
+            else:
+                failure = None
+            if failure == 429:
+                self.stats['rate_limited'] += 1
+            elif failure:
+                self.stats['errors'] += 1
+            jitter = self.rng.uniform(-options.jitter_ms, options.jitter_ms) if options.jitter_ms else 0
+        return failure, jitter
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def leave(self):
+        with self._lock:
+            self.stats['in_flight'] -= 1
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/chat/completions'):
+            kind = 'chat'
+        elif path.endswith('/audio/speech'):
+            kind = 'speech'
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'invalid JSON body'}})
+            return
+
+        server = self.server
+        options = server.options
+        failure, jitter = server.enter()
+        try:
+            if failure == 429:
+                self._send_json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}},
+                                {'Retry-After': str(options.retry_after)})
+            elif failure:
+                self._send_json(failure, {'error': {'message': 'Injected failure', 'type': 'server_error'}})
+            elif options.mode == 'record':
+                self._record(kind, body, raw)
+            elif options.mode == 'replay' and self._replay(kind, body):
+                pass
+            elif kind == 'chat':
+                self._chat(body, jitter)
+            else:
+                self._speech(body)
+        finally:
+            server.leave()
+
+    def _chat(self, body, jitter):
+        options = self.server.options
+        key = request_key('chat', body)
+        content = synthetic_reply(key, options.content_length)
+        model = body.get('model', 'stub')
+        created = int(time.time())
+        completion_id = f'chatcmpl-{key[:24]}'
+        time.sleep(max(0.0, options.latency_ms + jitter) / 1000)
+        if not body.get('stream'):
+            # one token per character is close enough for Chinese text
+            prompt_tokens = sum(len(m.get('content') or '') for m in body.get('messages', []))
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content),
+                          'total_tokens': prompt_tokens + len(content)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+
+        event({'role': 'assistant', 'content': ''})
+        step = max(1, options.stream_chunk_chars)
+        for start in range(0, len(content), step):
+            time.sleep(options.stream_interval_ms / 1000)
+            event({'content': content[start:start + step]})
+        event({}, 'stop')
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _speech(self, body):
+        options = self.server.options
+        text = body.get('input') or ''
+        time.sleep(options.tts_latency_ms / 1000)
+        self._send(200, silent_mp3(text), 'audio/mpeg')
+
+    def _record(self, kind, body, raw):
+        import requests
+
+        options = self.server.options
+        upstream = options.upstream if kind == 'chat' else options.tts_upstream
+        if not upstream:
+            self._send_json(502, {'error': {'message': f'no upstream configured for {kind}'}})
+            return
+        headers = {'Content-Type': 'application/json'}
+        if self.headers.get('Authorization'):
+            headers['Authorization'] = self.headers['Authorization']
+        started = time.perf_counter()
+        response = requests.post(upstream, data=raw, headers=headers, timeout=120)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        content_type = response.headers.get('Content-Type', 'application/json')
+        entry = {'key': request_key(kind, body), 'kind': kind, 'status': response.status_code,
+                 'content_type': content_type, 'retry_after': response.headers.get('Retry-After'),
+                 'elapsed_ms': elapsed_ms}
+        if content_type.startswith(('application/json', 'text/')):
+            entry['body'] = response.text
+        else:
+            entry['body_b64'] = base64.b64encode(response.content).decode('ascii')
+        self.server.cassette.append(entry)
+        self._send_entry(entry)
+
+    def _replay(self, kind, body):
+        """Serve the next recording for this request; False on a miss that falls back to synthetic"""
+        entry = self.server.cassette.next(kind, request_key(kind, body))
+        if entry is None:
+            self.server.count('replay_misses')
+            if self.server.options.replay_miss == 'synthetic':
+                return False
+            self._send_json(404, {'error': {'message': 'request not in cassette'}})
+            return True
+        time.sleep(entry.get('elapsed_ms', 0) / 1000 * self.server.options.replay_speed)
+        self._send_entry(entry)
+        return True
+
+    def _send_entry(self, entry):
+        if 'body_b64' in entry:
+            payload = base64.b64decode(entry['body_b64'])
+        else:
+            payload = entry['body'].encode('utf-8')
+        headers = {'Retry-After': entry['retry_after']} if entry.get('retry_after') else None
+        self._send(entry['status'], payload, entry['content_type'], headers)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json', headers)
+
+    def _send(self, status, payload, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve(options, host='127.0.0.1', port=0):
+    """Start a stub server in the background; returns it (see StubServer.url)"""
+    return StubServer((host, port), options).start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地模拟百炼对话接口与 TTS，支持延迟 / 429 / 错误注入和录制回放')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='对话接口延迟（毫秒）')
+    parser.add_argument('--jitter', type=float, default=0, help='延迟随机浮动范围（毫秒）')
+    parser.add_argument('--tts-latency', type=float, default=0, help='TTS 接口延迟（毫秒）')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='返回 429 的概率（0~1）')
+    parser.add_argument('--retry-after', type=int, default=1, help='429 响应的 Retry-After（秒）')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回错误的概率（0~1）')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--max-concurrency', type=int, default=0, help='超过该并发数时返回 429（0 表示不限）')
+    parser.add_argument('--content-length', type=int, default=DEFAULT_CONTENT_LENGTH, help='生成内容的字数')
+    parser.add_argument('--stream-chunk-chars', type=int, default=8, help='流式响应每块的字数')
+    parser.add_argument('--stream-interval', type=float, default=20, help='流式响应每块之间的间隔（毫秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--record', metavar='CASSETTE', help='转发到真实服务并把响应追加到该文件')
+    mode.add_argument('--replay', metavar='CASSETTE', help='按录制顺序回放该文件中的响应')
+    parser.add_argument('--upstream', help='录制时转发对话请求的地址')
+    parser.add_argument('--tts-upstream', help='录制时转发 TTS 请求的地址')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='回放延迟相对录制延迟的倍数（0 表示不等待）')
+    parser.add_argument('--replay-miss', choices=('error', 'synthetic'), default='error',
+                        help='回放时遇到未录制的请求：返回 404 或生成模拟响应')
+    parser.add_argument('--replay-match', choices=('request', 'sequence'), default='request',
+                        help='回放时按请求内容（忽略日期）匹配录制，或按录制顺序依次返回')
+    args = parser.parse_args()
+
+    if args.record and not (args.upstream or args.tts_upstream):
+        parser.error('--record 需要 --upstream 或 --tts-upstream')
+    if args.stream_chunk_chars <= 0:
+        parser.error('--stream-chunk-chars 必须大于 0')
+
+    options = StubOptions(
+        latency_ms=args.latency, jitter_ms=args.jitter, tts_latency_ms=args.tts_latency,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        error_rate=args.error_rate, error_status=args.error_status, max_concurrency=args.max_concurrency,
+        content_length=args.content_length, stream_chunk_chars=args.stream_chunk_chars,
+        stream_interval_ms=args.stream_interval, seed=args.seed,
+        mode='record' if args.record else 'replay' if args.replay else 'synthetic',
+        cassette=args.record or args.replay, upstream=args.upstream, tts_upstream=args.tts_upstream,
+        replay_speed=args.replay_speed, replay_miss=args.replay_miss, replay_match=args.replay_match,
+    )
+    server = StubServer((args.host, args.port), options)
+    print(f"🤖 AI 模拟服务已启动（{options.mode}）：{server.url}")
+    print(f"   BAILIAN_ENDPOINT={server.url}/v1/chat/completions")
+    print(f"   TTS_ENDPOINT={server.url}/v1/audio/speech")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,227 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import tracing
+from app import create_app
+from ai_service import LoveOneDayService, TokenBucket
+from extensions import db
+from models import LoveOneDayReport
+
+app = create_app()
+
+DEFAULT_STATE_FILE = os.path.join(app.instance_path, 'backfill_state.json')
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def date_range(start, end):
+    current = start
+    while current <= end:
+        yield current
+        current += timedelta(days=1)
+
+
+def load_state(path):
+    """读取断点续跑进度文件"""
+    if not os.path.exists(path):
+        return {'reports': [], 'audio': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    state.setdefault('reports', [])
+    state.setdefault('audio', [])
+    return state
+
+
+def save_state(path, state):
+    """原子写入进度文件，中途中断也不会损坏"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def audio_path_for(report_date):
+    reports_dir = os.path.join(app.root_path, 'static', 'reports')
+    os.makedirs(reports_dir, exist_ok=True)
+    return os.path.join(reports_dir, f"love_one_day_report_{report_date.strftime('%Y%m%d')}.mp3")
+
+
+def build_report(report_date, text, with_audio):
+    """在工作线程中生成单日播报（及语音），不写数据库"""
+    result = {'date': report_date, 'text': text, 'broadcast_type': None, 'audio_url': None}
+
+    # one trace per report
+    with tracing.span('backfill.build_report', parent=None,
+                      **{'report.date': report_date.isoformat(), 'with_audio': with_audio}):
+        if text is None:
+            with app.app_context():
+                data = LoveOneDayService.collect_daily_data(report_date)
+                # no canned fallback: a failed day is reported and retried on the next run
+                result['text'] = LoveOneDayService.generate_love_broadcast(data, allow_fallback=False)
+                result['broadcast_type'] = LoveOneDayService.get_broadcast_type(data)
+
+        if with_audio and result['text']:
+            audio_file = LoveOneDayService.text_to_speech(result['text'], audio_path_for(report_date))
+            if audio_file:
+                rel_path = os.path.relpath(audio_file, app.root_path)
+                result['audio_url'] = '/' + rel_path.replace('\\', '/')
+
+    return result
+
+
+def save_report(result):
+    """在主线程中写入数据库（同一日期只保留一条记录）"""
+    with tracing.span('backfill.save_report', parent=None, **{'report.date': result['date'].isoformat()}):
+        report = LoveOneDayReport.query.filter_by(report_date=result['date']).first()
+        if report is None:
+            report = LoveOneDayReport(report_date=result['date'])
+            db.session.add(report)
+        if result['broadcast_type']:
+            report.content = result['text']
+            report.broadcast_type = result['broadcast_type']
+            report.created_at = datetime.utcnow()
+        if result['audio_url']:
+            report.audio_url = result['audio_url']
+        db.session.commit()
+
+
+def backfill(start, end, workers=4, rate=1.0, burst=None, with_audio=False,
+             force=False, state_file=DEFAULT_STATE_FILE, reset=False):
+    """并发回填指定日期范围内的爱的一天播报"""
+    state = {'reports': [], 'audio': []} if reset else load_state(state_file)
+    done_reports = set(state['reports'])
+    done_audio = set(state['audio'])
+    # --force keeps its own progress under 'force': a new forced run redoes
+    # every date once, a rerun after an interruption skips what it already redid
+    if force:
+        forced = set(state.setdefault('force', {'reports': []})['reports'])
+
+    LoveOneDayService.rate_limiter = TokenBucket(rate, burst)
+
+    with app.app_context():
+        existing = {
+            r.report_date: r for r in LoveOneDayReport.query.filter(
+                LoveOneDayReport.report_date >= start,
+                LoveOneDayReport.report_date <= end
+            ).all()
+        }
+
+        jobs = []
+        for report_date in date_range(start, end):
+            key = report_date.isoformat()
+            report = existing.get(report_date)
+
+            # Existing rows are skipped unless --force
+            needs_text = report is None or (force and key not in forced)
+            needs_audio = with_audio and (
+                needs_text or (not report.audio_url and key not in done_audio)
+            )
+
+            if not needs_text and not needs_audio:
+                continue
+            text = None if needs_text else report.content
+            jobs.append((report_date, text, needs_audio))
+
+        total = len(jobs)
+        print("=" * 60)
+        print(f"爱的一天播报回填: {start} ~ {end}")
+        print(f"待处理 {total} 天，并发 {workers}，限速 {rate}/s")
+        print("=" * 60)
+
+        failed = []
+        completed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(build_report, report_date, text, needs_audio): report_date
+                for report_date, text, needs_audio in jobs
+            }
+            try:
+                for future in as_completed(futures):
+                    report_date = futures[future]
+                    key = report_date.isoformat()
+                    completed += 1
+                    try:
+                        result = future.result()
+                        save_report(result)
+                    except Exception as e:
+                        db.session.rollback()
+                        failed.append(key)
+                        print(f"❌ [{completed}/{total}] {key} 失败: {e}")
+                        continue
+
+                    if result['broadcast_type']:
+                        done_reports.add(key)
+                        if force:
+                            forced.add(key)
+                            state['force']['reports'] = sorted(forced)
+                    if result['audio_url']:
+                        done_audio.add(key)
+                    state['reports'] = sorted(done_reports)
+                    state['audio'] = sorted(done_audio)
+                    save_state(state_file, state)
+                    print(f"✅ [{completed}/{total}] {key} 完成")
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                print("\n⚠️  已中断，进度已保存，重新运行即可继续")
+                raise
+
+        if force and not failed:
+            # the forced run is complete; the next --force starts over
+            state.pop('force')
+            save_state(state_file, state)
+
+    print(f"\n回填完成: 成功 {total - len(failed)} 天，失败 {len(failed)} 天")
+    if failed:
+        print(f"失败的日期（未写入，重新运行即可重试）: {', '.join(sorted(failed))}")
+    return not failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='回填指定日期范围内的爱的一天播报')
+    parser.add_argument('--start', type=parse_date, required=True, help='开始日期 YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, help='结束日期 YYYY-MM-DD（默认今天）')
+    parser.add_argument('--workers', type=int, default=4, help='并发工作线程数')
+    parser.add_argument('--rate', type=float, default=1.0, help='每秒最多调用百炼 API 的次数')
+    parser.add_argument('--burst', type=float, default=None, help='令牌桶容量（默认等于 rate）')
+    parser.add_argument('--audio', action='store_true', help='同时生成语音文件')
+    parser.add_argument('--force', action='store_true', help='重新生成已存在的播报')
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE, help='断点续跑进度文件')
+    parser.add_argument('--reset', action='store_true', help='忽略已有进度从头开始')
+    args = parser.parse_args(argv)
+
+    end = args.end or datetime.now().date()
+    if args.start > end:
+        parser.error('--start 不能晚于 --end')
+    if args.rate <= 0:
+        parser.error('--rate 必须大于 0')
+    if args.burst is not None and args.burst <= 0:
+        parser.error('--burst 必须大于 0')
+
+    return backfill(
+        args.start, end,
+        workers=max(1, args.workers),
+        rate=args.rate,
+        burst=args.burst,
+        with_audio=args.audio,
+        force=args.force,
+        state_file=args.state_file,
+        reset=args.reset
+    )
+
+
+if __name__ == '__main__':
+    try:
+        success = main()
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,306 @@
+"""Reproducible HTTP / Socket.IO benchmark against a temporary database seeded by generate_data.py.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.15
+
+Each scenario is driven by `--concurrency` threads, each with its own Flask
+(or Socket.IO) test client, for `--requests` operations in total. Results are
+p50/p95/p99 latency in milliseconds plus throughput, written as JSON so runs
+can be compared against a stored baseline.
+
+`--ai-stub` starts ai_stub.py in-process, points BAILIAN_ENDPOINT and
+TTS_ENDPOINT at it and adds the Love One Day scenarios (LLM generation with
+retries and the work queue, the cached /today report, TTS). Its request, 429
+and peak-concurrency counts are stored under "ai_stub" in the results.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import platform
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+TOKENS = ('ck', 'wkl')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def http_client(app, token):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['token'] = token
+    return client
+
+
+def run_scenario(make_worker_state, operation, total, concurrency):
+    """Run `operation(state, i)` `total` times across `concurrency` threads"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(1, total // concurrency)
+    barrier = threading.Barrier(concurrency)
+
+    def worker(worker_id):
+        state = make_worker_state(worker_id)
+        local = []
+        local_errors = 0
+        barrier.wait()
+        for i in range(per_thread):
+            start = time.perf_counter()
+            try:
+                ok = operation(state, worker_id * per_thread + i)
+            except Exception:
+                ok = False
+            local.append(time.perf_counter() - start)
+            if not ok:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def build_scenarios(app, socketio, args):
+    moments = args.moments
+    deep_page = max(1, moments // 20 - 1)
+    rng = random.Random(args.seed)
+    moment_ids = [rng.randint(1, moments) for _ in range(args.requests)]
+
+    def http_state(worker_id):
+        return http_client(app, TOKENS[worker_id % 2])
+
+    def get(path_for):
+        return lambda client, i: client.get(path_for(i)).status_code == 200
+
+    def post_like(client, i):
+        return client.post(f'/moments/{moment_ids[i % len(moment_ids)]}/like').status_code == 200
+
+    def post_comment(client, i):
+        return client.post(f'/moments/{moment_ids[i % len(moment_ids)]}/comment',
+                           json={'content': f'bench {i}'}).status_code == 200
+
+    def socket_state(worker_id):
+        client = http_client(app, TOKENS[worker_id % 2])
+        sio = socketio.test_client(app, flask_test_client=client)
+        sio.emit('join', {'room': 'couple_room'})
+        sio.get_received()
+        return sio
+
+    def socket_message(sio, i):
+        sio.emit('message', {'content': f'bench {i}', 'room': 'couple_room'})
+        sio.get_received()
+        return True
+
+    def socket_typing(sio, i):
+        event = 'typing' if i % 2 == 0 else 'stop_typing'
+        sio.emit(event, {'room': 'couple_room'})
+        sio.get_received()
+        return True
+
+    scenarios = [
+        ('moments_first_page', http_state, get(lambda i: '/api/moments')),
+        ('moments_keyword_search', http_state, get(lambda i: '/api/moments?keyword=旅行')),
+        ('moments_deep_page', http_state, get(lambda i: f'/api/moments?page={deep_page}')),
+        ('moment_comments', http_state,
+         get(lambda i: f'/api/moments/{moment_ids[i % len(moment_ids)]}/comments')),
+        ('chat_history', http_state, get(lambda i: '/api/chat/history?limit=50')),
+        ('chat_history_paged', http_state,
+         get(lambda i: f'/api/chat/history?limit=50&before_id={args.messages - i % 1000}')),
+        ('like_toggle', http_state, post_like),
+        ('comment_add', http_state, post_comment),
+        ('socket_message', socket_state, socket_message),
+        ('socket_typing', socket_state, socket_typing),
+    ]
+    if args.ai_stub:
+        scenarios += ai_scenarios(app, http_state)
+    return scenarios
+
+
+def ai_scenarios(app, http_state):
+    """Love One Day scenarios; need BAILIAN_ENDPOINT / TTS_ENDPOINT pointing at ai_stub.py"""
+    from datetime import date
+
+    import rate_limit
+    from ai_service import LoveOneDayService
+    from extensions import db
+    from models import LoveOneDayReport
+
+    def app_state(worker_id):
+        return None
+
+    def generate(state, i):
+        # the LLM path only: data collection, the call with its retries, and the llm work queue
+        with app.app_context():
+            try:
+                with rate_limit.work_slot('llm'):
+                    data = LoveOneDayService.collect_daily_data()
+                    LoveOneDayService.generate_love_broadcast(data)
+            except rate_limit.QueueFull:
+                return False
+        return True
+
+    def today_state(worker_id):
+        # start uncached, so the first requests race to generate the report
+        if worker_id == 0:
+            with app.app_context():
+                LoveOneDayReport.query.filter_by(report_date=date.today()).delete()
+                db.session.commit()
+        return http_state(worker_id)
+
+    def tts(client, i):
+        response = client.post('/api/love-one-day/tts', json={'text': f'bench {i} ' * 20})
+        if response.status_code != 200:
+            return False
+        # file names have one-second resolution, so concurrent calls may share (and remove) a file
+        path = os.path.join(app.root_path, response.get_json()['data']['audio_url'].lstrip('/'))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    return [
+        ('love_one_day_generate', app_state, generate),
+        ('love_one_day_today', today_state,
+         lambda client, i: client.get('/api/love-one-day/today').status_code == 200),
+        ('love_one_day_tts', http_state, tts),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """Print p95/throughput deltas against a baseline; returns the regressed scenario names"""
+    regressions = []
+    print(f"\n{'scenario':<24}{'p95 ms':>12}{'base':>10}{'Δ':>9}{'rps':>10}{'base':>10}{'Δ':>9}")
+    for name, current in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        p95_delta = (current['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+        rps_delta = ((current['throughput_rps'] - base['throughput_rps']) / base['throughput_rps']
+                     if base['throughput_rps'] else 0.0)
+        flag = ''
+        if p95_delta > tolerance or rps_delta < -tolerance:
+            regressions.append(name)
+            flag = '  ⚠️'
+        print(f"{name:<24}{current['p95_ms']:>12.2f}{base['p95_ms']:>10.2f}{p95_delta:>+9.1%}"
+              f"{current['throughput_rps']:>10.1f}{base['throughput_rps']:>10.1f}{rps_delta:>+9.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Love Plane HTTP / Socket.IO benchmark')
+    parser.add_argument('--moments', type=int, default=2000)
+    parser.add_argument('--comments-per-moment', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=400, help='operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', nargs='*', help='run only these scenarios')
+    parser.add_argument('--output', help='write results JSON to this file')
+    parser.add_argument('--baseline', help='compare against a previous results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed relative p95/throughput regression before failing')
+    parser.add_argument('--ai-stub', action='store_true',
+                        help='run the Love One Day scenarios against a local ai_stub.py')
+    parser.add_argument('--ai-latency', type=float, default=500, help='stub chat latency in ms')
+    parser.add_argument('--ai-jitter', type=float, default=100, help='stub chat latency jitter in ms')
+    parser.add_argument('--ai-429-rate', type=float, default=0.0, help='share of stub chat calls answered with 429')
+    parser.add_argument('--ai-error-rate', type=float, default=0.0, help='share of stub calls answered with 500')
+    parser.add_argument('--tts-latency', type=float, default=300, help='stub TTS latency in ms')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='love_plane_bench_')
+    os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('SQL_INSTRUMENTATION', 'off')
+    # the load generator would otherwise measure the per-user rate limits
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+    stub = None
+    if args.ai_stub:
+        import ai_stub
+
+        stub = ai_stub.serve(ai_stub.StubOptions(
+            latency_ms=args.ai_latency, jitter_ms=args.ai_jitter, tts_latency_ms=args.tts_latency,
+            rate_limit_rate=args.ai_429_rate, retry_after=0, error_rate=args.ai_error_rate, seed=args.seed,
+        ))
+        os.environ['BAILIAN_API_KEY'] = 'stub'
+        os.environ['BAILIAN_ENDPOINT'] = f'{stub.url}/v1/chat/completions'
+        os.environ['TTS_ENDPOINT'] = f'{stub.url}/v1/audio/speech'
+
+    from app import create_app
+    from extensions import db, socketio
+
+    app = create_app()
+    from generate_data import generate
+
+    generate(app, db, moments=args.moments, comments=args.moments * args.comments_per_moment,
+             messages=args.messages, seed=args.seed, verbose=False)
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'only')},
+        'scenarios': {},
+    }
+    for name, make_state, operation in build_scenarios(app, socketio, args):
+        if args.only and name not in args.only:
+            continue
+        summary = run_scenario(make_state, operation, args.requests, args.concurrency)
+        results['scenarios'][name] = summary
+        print(f"{name:<24} p50 {summary['p50_ms']:>8.2f}ms  p95 {summary['p95_ms']:>8.2f}ms  "
+              f"p99 {summary['p99_ms']:>8.2f}ms  {summary['throughput_rps']:>8.1f} req/s  "
+              f"errors {summary['errors']}")
+    if stub is not None:
+        results['ai_stub'] = stub.snapshot()
+        print(f"ai_stub: {results['ai_stub']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
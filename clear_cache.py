@@ -2,7 +2,11 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db, LoveOneDayReport
+from app import create_app
+from extensions import db
+from models import LoveOneDayReport
+
+app = create_app()
 
 def clear_love_one_day_cache():
     """清除爱的一天缓存"""
@@ -0,0 +1,67 @@
+"""gzip / brotli response compression.
+
+Enabled by ``COMPRESS`` (default on). Responses whose body is at least
+``COMPRESS_MIN_SIZE`` bytes and whose mimetype is in ``COMPRESS_MIMETYPES``
+are compressed with the best encoding the client accepts: brotli when the
+optional ``brotli`` package is installed, otherwise gzip. Streamed responses (NDJSON export, send_file) are left alone.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+DEFAULT_MIMETYPES = (
+    'application/json', 'text/html', 'text/css', 'text/plain',
+    'application/javascript', 'text/javascript',
+)
+
+
+def choose_encoding(accept_encodings):
+    """Best supported encoding by client quality; None if nothing acceptable"""
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0
+    for encoding in candidates:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level['br'])
+    return gzip.compress(data, compresslevel=level['gzip'], mtime=0)
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+    if not app.config['COMPRESS']:
+        return
+
+    from flask import request
+
+    level = {'gzip': app.config['COMPRESS_GZIP_LEVEL'], 'br': app.config['COMPRESS_BROTLI_QUALITY']}
+    mimetypes = frozenset(app.config['COMPRESS_MIMETYPES'])
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code >= 300
+                or response.mimetype not in mimetypes
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.content_length or 0) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        response.set_data(compress(response.get_data(), encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,166 @@
+"""Streaming export of all data as a ZIP archive.
+
+The archive is written while it is being downloaded:
+
+- ``data/<table>.ndjson`` for every model, read with server-side cursors in
+  batches of ``EXPORT_BATCH_SIZE`` rows (user tokens are left out)
+- ``static/uploads/...`` and ``static/reports/...``: the files referenced by
+  moments and reports, copied in ``EXPORT_CHUNK_SIZE`` chunks and stored
+  uncompressed (images and mp3s are already compressed)
+
+zipfile writes into a sink that is drained after every batch or chunk, so
+memory stays flat whatever the size of the archive; only the central
+directory (a small record per entry) is kept until the end.
+
+Only the current couple's data is exported (see tenancy.py).
+
+Usage: python data_export.py [-o love_plane_export.zip] [--couple ID]
+"""
+import json
+import os
+import sys
+import time
+import zipfile
+
+import tenancy
+
+from extensions import db
+from models import User, Anniversary, Moment, Comment, Like, Message, ArchivedMessage, LoveOneDayReport
+
+EXPORT_FILE_DIRS = ('static/uploads', 'static/reports')
+
+# (archive name, model, columns left out)
+EXPORT_TABLES = (
+    ('users', User, {'token'}),
+    ('anniversaries', Anniversary, set()),
+    ('moments', Moment, set()),
+    ('comments', Comment, set()),
+    ('likes', Like, set()),
+    ('messages', Message, set()),
+    ('message_archive', ArchivedMessage, set()),
+    ('love_one_day_reports', LoveOneDayReport, set()),
+)
+
+
+class ChunkSink:
+    """Write-only, unseekable file object for zipfile; drain() hands over what was written"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_rows(model, excluded, batch_size):
+    columns = [column for column in model.__table__.columns if column.key not in excluded]
+    result = db.session.execute(
+        db.select(*columns).order_by(model.id).execution_options(yield_per=batch_size)
+    )
+    for batch in result.partitions():
+        yield [row._asdict() for row in batch]
+
+
+def referenced_files(batch_size):
+    """URL paths of the moment images and report audio files"""
+    result = db.session.execute(
+        db.select(Moment.images_json).execution_options(yield_per=batch_size)
+    )
+    for images_json, in result:
+        yield from json.loads(images_json or '[]')
+    result = db.session.execute(
+        db.select(LoveOneDayReport.audio_url)
+        .where(LoveOneDayReport.audio_url.isnot(None))
+        .execution_options(yield_per=batch_size)
+    )
+    for audio_url, in result:
+        yield audio_url
+
+
+def resolve_static_file(root, url):
+    """(archive name, path) of an exportable file, or None if it is missing or outside EXPORT_FILE_DIRS"""
+    name = os.path.normpath(url.lstrip('/')).replace(os.sep, '/')
+    if not any(name.startswith(directory + '/') for directory in EXPORT_FILE_DIRS):
+        return None
+    path = os.path.join(root, name)
+    return (name, path) if os.path.isfile(path) else None
+
+
+def iter_archive(app):
+    """Yield the bytes of the ZIP archive as they are produced; needs an app context"""
+    return (data for data in _generate_archive(app) if data)
+
+
+def _generate_archive(app):
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+    dumps = app.json.dumps
+    sink = ChunkSink()
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, model, excluded in EXPORT_TABLES:
+            info = zipfile.ZipInfo(f'data/{name}.ndjson', time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # size is unknown up front; force_zip64 allows entries over 2 GiB
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for rows in iter_rows(model, excluded, batch_size):
+                    entry.write(''.join(dumps(row) + '\n' for row in rows).encode('utf-8'))
+                    yield sink.drain()
+            yield sink.drain()
+
+        for url in referenced_files(batch_size):
+            resolved = resolve_static_file(app.root_path, url)
+            if resolved is None or resolved[0] in archive.NameToInfo:
+                continue
+            name, path = resolved
+            info = zipfile.ZipInfo.from_file(path, name)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, archive.open(info, 'w') as entry:
+                while chunk := src.read(chunk_size):
+                    entry.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    # central directory
+    yield sink.drain()
+
+
+def init_app(app):
+    app.config.setdefault('EXPORT_BATCH_SIZE', 500)
+    app.config.setdefault('EXPORT_CHUNK_SIZE', 64 * 1024)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='导出全部数据为 ZIP（流式写入）')
+    parser.add_argument('-o', '--output', default=f"love_plane_export_{time.strftime('%Y%m%d%H%M%S')}.zip",
+                        help="输出文件，'-' 表示写到标准输出")
+    parser.add_argument('--couple', type=int, help='启用 TENANCY 时要导出的情侣 id')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    started = time.perf_counter()
+    written = 0
+    with app.app_context():
+        tenancy.select_couple(args.couple)
+        out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            for data in iter_archive(app):
+                out.write(data)
+                written += len(data)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    print(f"导出完成：{args.output}，{written / 1024 / 1024:.1f} MB，用时 {time.perf_counter() - started:.1f}s",
+          file=sys.stderr)
@@ -0,0 +1,259 @@
+"""Production SQLite profile: WAL, a pool of read-only connections and one serialized writer.
+
+Enabled with ``DB_PROFILE=production`` for ``sqlite://`` database URIs. Any other
+configuration keeps the stock Flask-SQLAlchemy engine and session behaviour.
+
+With ``TENANCY`` on, RoutingSession sends the queries of a selected couple to
+that couple's shard file instead (ShardRouter, see tenancy.py).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from flask_sqlalchemy.session import Session
+
+import tenancy
+
+# Applied to every connection (reader and writer)
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+)
+
+WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER')
+
+
+def is_enabled(app):
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    return app.config.get('DB_PROFILE') == 'production' and uri.startswith('sqlite:')
+
+
+def configure_engine_options(app):
+    """Set writer engine options; must run before SQLAlchemy(app)"""
+    if not is_enabled(app):
+        return
+    busy_timeout = app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.update({
+        # A single connection: writers queue on the pool instead of on SQLite locks
+        'poolclass': QueuePool,
+        'pool_size': 1,
+        'max_overflow': 0,
+        'pool_timeout': busy_timeout,
+        'connect_args': {'timeout': busy_timeout, 'check_same_thread': False},
+    })
+
+
+def _apply_pragmas(dbapi_connection, busy_timeout_ms, extra=()):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+    for pragma in SQLITE_PRAGMAS + tuple(extra):
+        cursor.execute(pragma)
+    cursor.close()
+
+
+class ShardRouter:
+    """One small WAL-mode engine per couple shard file, opened on demand.
+
+    At most ``max_open`` engines are kept; the least recently used one is
+    retired when another shard is opened and disposed once none of its
+    connections is checked out. A shard's schema is created and migrated the
+    first time this process opens it, under a lock of its own: a couple whose
+    shard is being migrated doesn't hold up requests for the other couples.
+    """
+
+    def __init__(self, shard_dir, metadata, max_open, pool_size, busy_timeout_ms):
+        self.shard_dir = shard_dir
+        self.metadata = metadata
+        self.max_open = max_open
+        self.pool_size = pool_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._engines = OrderedDict()
+        self._retired = []
+        self._initialized = set()
+        self._open_locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def shard_path(self, couple_id):
+        return os.path.join(self.shard_dir, f'couple_{int(couple_id)}.db')
+
+    def _cached(self, couple_id):
+        engine = self._engines.get(couple_id)
+        if engine is not None:
+            self._engines.move_to_end(couple_id)
+        return engine
+
+    def engine_for(self, couple_id):
+        with self._lock:
+            engine = self._cached(couple_id)
+            if engine is not None:
+                return engine
+            open_lock = self._open_locks.setdefault(couple_id, threading.Lock())
+
+        with open_lock:
+            try:
+                with self._lock:
+                    engine = self._cached(couple_id)
+                    if engine is not None:
+                        return engine
+                # slow (file creation, create_all, migrations): outside the router lock
+                engine = self._open(couple_id)
+                with self._lock:
+                    self._engines[couple_id] = engine
+                    while len(self._engines) > self.max_open:
+                        _, evicted = self._engines.popitem(last=False)
+                        self._retired.append(evicted)
+                    self._dispose_idle()
+                return engine
+            finally:
+                # only needed while the shard is being opened: threads already
+                # waiting on it find the engine cached, so _open_locks stays as
+                # small as the number of shards opening right now
+                with self._lock:
+                    if self._open_locks.get(couple_id) is open_lock:
+                        del self._open_locks[couple_id]
+
+    def _dispose_idle(self):
+        """Dispose retired engines that no session is using any more (under the router lock)"""
+        busy = []
+        for engine in self._retired:
+            if engine.pool.checkedout():
+                busy.append(engine)
+            else:
+                engine.dispose()
+        self._retired = busy
+
+    def _open(self, couple_id):
+        busy_timeout = self.busy_timeout_ms / 1000
+        engine = create_engine(
+            f'sqlite:///{self.shard_path(couple_id)}',
+            poolclass=QueuePool,
+            pool_size=self.pool_size,
+            max_overflow=self.pool_size,
+            pool_timeout=busy_timeout,
+            connect_args={'timeout': busy_timeout, 'check_same_thread': False},
+        )
+        busy_timeout_ms = self.busy_timeout_ms
+
+        @event.listens_for(engine, 'connect')
+        def _shard_connect(dbapi_connection, connection_record):
+            _apply_pragmas(dbapi_connection, busy_timeout_ms, ('PRAGMA journal_mode = WAL',))
+
+        if couple_id not in self._initialized:
+            from migrations import run_migrations
+            self.metadata.create_all(engine)
+            run_migrations(engine)
+            self._initialized.add(couple_id)
+        return engine
+
+    def dispose(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            for engine in self._retired:
+                engine.dispose()
+            self._engines.clear()
+            self._retired = []
+
+
+def init_app(app, db):
+    """Install pragmas on the writer and create the reader pool or the shard router"""
+    if tenancy.is_enabled(app):
+        app.extensions['shard_router'] = ShardRouter(
+            app.config['TENANT_SHARD_DIR'], db.metadata, app.config['TENANT_MAX_OPEN_SHARDS'],
+            app.config['TENANT_SHARD_POOL_SIZE'], app.config['SQLITE_BUSY_TIMEOUT_MS'],
+        )
+    if not is_enabled(app):
+        return
+
+    with app.app_context():
+        writer = db.engine
+    busy_timeout_ms = app.config['SQLITE_BUSY_TIMEOUT_MS']
+
+    @event.listens_for(writer, 'connect')
+    def _writer_connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself (pysqlite's implicit BEGIN is deferred)
+        dbapi_connection.isolation_level = None
+        _apply_pragmas(dbapi_connection, busy_timeout_ms, ('PRAGMA journal_mode = WAL',))
+
+    @event.listens_for(writer, 'begin')
+    def _writer_begin(conn):
+        # Take the write lock up front so short transactions never deadlock on upgrade
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    pool_size = app.config['DB_READER_POOL_SIZE']
+    busy_timeout = busy_timeout_ms / 1000
+    reader = create_engine(
+        writer.url,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        pool_timeout=busy_timeout,
+        connect_args={'timeout': busy_timeout, 'check_same_thread': False},
+    )
+
+    @event.listens_for(reader, 'connect')
+    def _reader_connect(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection, busy_timeout_ms, ('PRAGMA query_only = ON',))
+
+    app.extensions['db_reader'] = reader
+
+
+def _is_write(clause):
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip().upper().startswith(WRITE_KEYWORDS)
+    return False
+
+
+class RoutingSession(Session):
+    """Sends reads to the reader pool and flushes/DML to the writer.
+
+    Once a transaction has written, later reads stay on the writer until it ends so
+    the session always sees its own uncommitted changes.
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self._writing = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and current_app:
+            router = current_app.extensions.get('shard_router')
+            couple_id = tenancy.current_couple_id() if router is not None else None
+            if couple_id is not None:
+                return router.engine_for(couple_id)
+        if bind is None and not self._writing:
+            reader = current_app.extensions.get('db_reader') if current_app else None
+            if reader is not None:
+                if not self._flushing and not _is_write(clause):
+                    return reader
+                self._writing = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            self._writing = False
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._writing = False
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._writing = False
@@ -0,0 +1,8 @@
+"""Extension instances, bound to an application by create_app()"""
+from flask_sqlalchemy import SQLAlchemy
+from flask_socketio import SocketIO
+
+import db_profile
+
+db = SQLAlchemy(session_options={'class_': db_profile.RoutingSession})
+socketio = SocketIO()
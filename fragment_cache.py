@@ -0,0 +1,101 @@
+"""Template fragment cache.
+
+Wrap a block in ``{% cache 'name', key_part, ... %}...{% endcache %}`` to
+store its rendered HTML. Entries are keyed by the fragment name, the extra key
+parts (e.g. the user id), the current couple (see tenancy.py), the current
+date, so day counters roll over at midnight, and a data-version stamp per
+fragment name and couple. Mutating routes call ``bump('name')`` to move the
+couple's stamp forward, which makes every cached copy of that fragment
+unreachable; stale entries age out of the LRU.
+
+Data the fragment needs should be passed to the template lazily (a query, not
+its results) so nothing is queried when the fragment is served from cache.
+The cache is per process; ``FRAGMENT_CACHE=0`` renders every block live.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+import tenancy
+
+
+class FragmentCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, name):
+        return self._versions.get(name, 0)
+
+    def bump(self, *names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_fragment', [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_fragment(self, args, caller):
+        cache = current_app.extensions.get('fragment_cache')
+        if cache is None:
+            return caller()
+        name = (tenancy.current_couple_id(), args[0])
+        key = (name, cache.version(name), date.today(), *args[1:])
+        html = cache.get(key)
+        if html is None:
+            html = Markup(caller())
+            cache.set(key, html)
+        return html
+
+
+def bump(*names, couples=None):
+    """Invalidate every cached copy of the named fragments, for the current couple or each of `couples`"""
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is not None:
+        if couples is None:
+            couples = (tenancy.current_couple_id(),)
+        cache.bump(*((couple_id, name) for couple_id in couples for name in names))
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE', True)
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 256)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['FRAGMENT_CACHE']:
+        app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
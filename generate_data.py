@@ -0,0 +1,266 @@
+"""Synthetic data generator for production-sized databases.
+
+Unlike seed_data.py (which inserts a handful of rows through the ORM), this
+writes every table with bulk Core inserts in large batches inside a single
+transaction, so a database with millions of rows takes seconds to build.
+
+Usage:
+    python generate_data.py --reset --moments 200000 --comments 600000 --messages 500000
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import bisect
+import itertools
+import json
+import random
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+WORDS = ['今天', '一起', '散步', '晚餐', '电影', '旅行', '开心', '想你', '下雨', '咖啡',
+         '周末', '拥抱', '晚安', '早安', '礼物', '海边', '火锅', '猫咪', '日落', '纪念']
+DEFAULT_USERS = (
+    {'name': 'Boy', 'token': 'ck', 'role': 'male',
+     'avatar': 'https://cdn-icons-png.flaticon.com/512/4140/4140048.png'},
+    {'name': 'Girl', 'token': 'wkl', 'role': 'female',
+     'avatar': 'https://cdn-icons-png.flaticon.com/512/4140/4140047.png'},
+)
+REPORT_TYPES = ('anniversary', 'historical_moments', 'historical_events')
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def sentence_pool(rng, min_words, max_words, size=4096):
+    """Pre-built texts; picking from a pool is far cheaper than composing each row"""
+    return [''.join(rng.choices(WORDS, k=rng.randint(min_words, max_words))) for _ in range(size)]
+
+
+def zipf_cum_weights(n, skew):
+    """Cumulative weights giving rank r a weight of 1 / r**skew (skew 0 = uniform)"""
+    total = 0.0
+    cum = array('d')
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** skew
+        cum.append(total)
+    return cum
+
+
+def weighted_index(rng, cum_weights):
+    return bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])
+
+
+def generate(app, db, moments=10000, comments=30000, likes_rate=0.4, messages=100000,
+             anniversaries=20, reports=365, years=3, image_ratio=0.3, max_images=4,
+             comment_skew=1.0, like_skew=0.5, images=None, batch_size=5000, seed=42,
+             reset=False, verbose=True):
+    """Bulk-generate a couple's history; returns {table: inserted row count}"""
+    from models import User, Anniversary, Moment, Comment, Like, Message, LoveOneDayReport
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=365 * years)
+    span = (now - start).total_seconds()
+    images = list(images or [])
+    counts = {}
+    long_texts = sentence_pool(rng, 4, 30)
+    short_texts = sentence_pool(rng, 1, 12)
+    report_texts = sentence_pool(rng, 60, 120, size=256)
+
+    def log(message):
+        if verbose:
+            print(message)
+
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+
+        with db.engine.begin() as conn:
+            def bulk(model, rows):
+                table = model.__table__
+                inserted = 0
+                for batch in batched(rows, batch_size):
+                    conn.execute(table.insert(), batch)
+                    inserted += len(batch)
+                counts[table.name] = counts.get(table.name, 0) + inserted
+                log(f"  {table.name:<22} {inserted:>10,} rows")
+
+            def next_id(model):
+                return (conn.execute(db.select(db.func.max(model.id))).scalar() or 0) + 1
+
+            user_ids = []
+            for user in DEFAULT_USERS:
+                existing = conn.execute(
+                    db.select(User.id).where(User.token == user['token'])
+                ).scalar()
+                if existing is None:
+                    existing = conn.execute(User.__table__.insert().values(**user)).inserted_primary_key[0]
+                user_ids.append(existing)
+
+            today = date.today()
+            anniversary_dates = [
+                (start + timedelta(seconds=rng.uniform(0, span))).date() for _ in range(anniversaries)
+            ]
+            bulk(Anniversary, ({
+                'title': f"纪念日 {i + 1}",
+                'date': d,
+                'next_occurrence': Anniversary.compute_next_occurrence(d, today),
+            } for i, d in enumerate(anniversary_dates)))
+
+            # Moments are spread evenly over the span with jitter; remember each
+            # timestamp so comments can be placed after their moment.
+            first_moment = next_id(Moment)
+            step = span / max(moments, 1)
+            moment_times = array('d', (
+                i * step + rng.uniform(0, step) for i in range(moments)
+            ))
+
+            def moment_rows():
+                for i, offset in enumerate(moment_times):
+                    picked = []
+                    if images and rng.random() < image_ratio:
+                        picked = rng.sample(images, min(len(images), rng.randint(1, max_images)))
+                    yield {
+                        'id': first_moment + i,
+                        'content': rng.choice(long_texts),
+                        'user_id': user_ids[i % len(user_ids)],
+                        'timestamp': start + timedelta(seconds=offset),
+                        'images_json': json.dumps(picked),
+                        'is_pinned': False,
+                    }
+            bulk(Moment, moment_rows())
+
+            if moments:
+                # A few pinned moments per user, like real usage
+                for user_id in user_ids:
+                    conn.execute(
+                        Moment.__table__.update().where(
+                            Moment.id.in_(db.select(Moment.id).where(Moment.user_id == user_id)
+                                          .order_by(Moment.timestamp.desc()).limit(rng.randint(0, 3)))
+                        ).values(is_pinned=True)
+                    )
+
+                # Comment/like skew: rank 1 is the most popular moment
+                popularity = list(range(moments))
+                rng.shuffle(popularity)
+                comment_weights = zipf_cum_weights(moments, comment_skew)
+
+                def comment_rows():
+                    for _ in range(comments):
+                        index = popularity[weighted_index(rng, comment_weights)]
+                        offset = min(span, moment_times[index] + rng.expovariate(1 / 86400))
+                        yield {
+                            'content': rng.choice(short_texts),
+                            'user_id': rng.choice(user_ids),
+                            'moment_id': first_moment + index,
+                            'timestamp': start + timedelta(seconds=offset),
+                        }
+                bulk(Comment, comment_rows())
+
+                like_weights = zipf_cum_weights(moments, like_skew)
+                mean_weight = like_weights[-1] / moments
+
+                def like_rows():
+                    for rank, index in enumerate(popularity, start=1):
+                        probability = min(1.0, likes_rate / rank ** like_skew / mean_weight)
+                        for user_id in user_ids:
+                            if rng.random() < probability:
+                                yield {'user_id': user_id, 'moment_id': first_moment + index}
+                bulk(Like, like_rows())
+
+            message_step = span / max(messages, 1)
+
+            def message_rows():
+                sender = 0
+                for i in range(messages):
+                    if rng.random() < 0.35:
+                        sender = 1 - sender
+                    yield {
+                        'sender_id': user_ids[sender % len(user_ids)],
+                        'content': rng.choice(short_texts),
+                        'timestamp': start + timedelta(seconds=i * message_step),
+                    }
+            bulk(Message, message_rows())
+
+            taken = set(conn.execute(db.select(LoveOneDayReport.report_date)).scalars())
+
+            def report_rows():
+                for days_ago in range(reports):
+                    report_date = today - timedelta(days=days_ago)
+                    if report_date in taken:
+                        continue
+                    content = rng.choice(report_texts)
+                    yield {
+                        'report_date': report_date,
+                        'content': content,
+                        'preview': LoveOneDayReport.make_preview(content),
+                        'broadcast_type': rng.choice(REPORT_TYPES),
+                        'created_at': datetime.combine(report_date, datetime.min.time()) + timedelta(hours=6),
+                        'is_pushed': True,
+                    }
+            bulk(LoveOneDayReport, report_rows())
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量生成测试数据（Core 批量插入）')
+    parser.add_argument('--moments', type=int, default=10000)
+    parser.add_argument('--comments', type=int, default=30000, help='评论总数')
+    parser.add_argument('--likes-rate', type=float, default=0.4, help='平均每人点赞的动态比例')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--anniversaries', type=int, default=20)
+    parser.add_argument('--reports', type=int, default=365, help='生成最近多少天的播报')
+    parser.add_argument('--years', type=float, default=3, help='数据跨越的年数')
+    parser.add_argument('--image-ratio', type=float, default=0.3, help='带图片的动态比例')
+    parser.add_argument('--max-images', type=int, default=4)
+    parser.add_argument('--image-dir', default='static/uploads',
+                        help='从该目录选取图片作为引用（不存在则生成虚拟路径）')
+    parser.add_argument('--comment-skew', type=float, default=1.0, help='评论分布的 Zipf 指数，0 为均匀')
+    parser.add_argument('--like-skew', type=float, default=0.5, help='点赞集中程度，0 为均匀')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='先清空所有表')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from extensions import db
+
+    app = create_app()
+
+    image_dir = os.path.join(app.root_path, args.image_dir)
+    if os.path.isdir(image_dir):
+        images = [f"/{args.image_dir.strip('/')}/{name}" for name in sorted(os.listdir(image_dir))]
+    else:
+        images = []
+    images = images or [f"/static/uploads/synthetic_{i}.jpg" for i in range(50)]
+
+    print("=" * 60)
+    print("生成测试数据")
+    print("=" * 60)
+    started = time.perf_counter()
+    counts = generate(
+        app, db,
+        moments=args.moments, comments=args.comments, likes_rate=args.likes_rate,
+        messages=args.messages, anniversaries=args.anniversaries, reports=args.reports,
+        years=args.years, image_ratio=args.image_ratio, max_images=args.max_images,
+        comment_skew=args.comment_skew, like_skew=args.like_skew, images=images,
+        batch_size=args.batch_size, seed=args.seed, reset=args.reset
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"\n共插入 {total:,} 行，用时 {elapsed:.1f}s（{total / elapsed:,.0f} 行/秒）")
+
+
+if __name__ == '__main__':
+    main()
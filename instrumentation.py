@@ -0,0 +1,246 @@
+"""Per-request SQL instrumentation with a simple N+1 detector.
+
+Every HTTP request and Socket.IO event gets a QueryStats collector (query
+count, total DB time, slowest statements and how often each statement shape
+ran). Depending on ``SQL_INSTRUMENTATION`` the result is exposed as response
+headers (``headers``, default in debug mode), as one JSON log line per
+request (``log``, default otherwise) or not collected at all (``off``).
+
+``SQL_MAX_QUERIES`` / ``SQL_QUERY_BUDGETS`` (endpoint -> max queries) turn a
+query-count regression into a QueryBudgetExceeded error when ``TESTING`` is
+on, and into a warning otherwise. ``assert_max_queries()`` does the same for
+an arbitrary block of test code. Streamed responses (``?stream=ndjson``, the
+data export) run their queries while the body is sent, so they are counted
+and checked when the response finishes; they get no ``X-DB-*`` headers.
+"""
+import contextvars
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+import tracing
+
+logger = logging.getLogger('love_plane.sql')
+
+SLOWEST_KEEP = 3
+
+_current = contextvars.ContextVar('sql_query_stats', default=None)
+_listening = False
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\bIN \(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    """Collapse whitespace and IN-lists so repeated statements compare equal"""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    return _IN_LIST.sub('IN (?)', shape)
+
+
+class QueryStats:
+    __slots__ = ('name', 'parent', 'count', 'total_time', 'shapes', 'slowest')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = {}
+        self.slowest = []
+
+    def record(self, statement, duration):
+        stats = self
+        while stats is not None:
+            stats._record(statement, duration)
+            stats = stats.parent
+
+    def _record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        shape = statement_shape(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+        if len(self.slowest) < SLOWEST_KEEP or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, shape))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[SLOWEST_KEEP:]
+
+    def repeated(self, threshold):
+        """Statement shapes that ran at least `threshold` times (likely N+1s)"""
+        return sorted(
+            ((shape, count) for shape, count in self.shapes.items() if count >= threshold),
+            key=lambda item: item[1], reverse=True
+        )
+
+    def as_dict(self, threshold):
+        return {
+            'name': self.name,
+            'queries': self.count,
+            'db_time_ms': round(self.total_time * 1000, 2),
+            'slowest': [
+                {'ms': round(duration * 1000, 2), 'sql': shape[:200]}
+                for duration, shape in self.slowest
+            ],
+            'n_plus_one': [
+                {'count': count, 'sql': shape[:200]}
+                for shape, count in self.repeated(threshold)
+            ],
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get('query_start')
+    if stats is not None and starts:
+        stats.record(statement, time.perf_counter() - starts.pop())
+
+
+def start(name):
+    return _current.set(QueryStats(name, parent=_current.get()))
+
+
+def finish(token):
+    stats = _current.get()
+    _current.reset(token)
+    return stats
+
+
+def _mode(app):
+    return app.config.get('SQL_INSTRUMENTATION') or ('headers' if app.debug else 'log')
+
+
+def _check_budget(app, stats, endpoint):
+    budget = app.config.get('SQL_QUERY_BUDGETS', {}).get(endpoint, app.config.get('SQL_MAX_QUERIES'))
+    if budget is None or stats.count <= budget:
+        return
+    message = f"{stats.name} ran {stats.count} queries (budget {budget})"
+    if app.testing:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def _report(app, stats, endpoint=None):
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    _check_budget(app, stats, endpoint)
+    if _mode(app) == 'log':
+        if stats.count:
+            logger.info(json.dumps(stats.as_dict(threshold), ensure_ascii=False))
+    elif stats.repeated(threshold):
+        logger.warning('Possible N+1 in %s: %s', stats.name,
+                       json.dumps(stats.as_dict(threshold)['n_plus_one'], ensure_ascii=False))
+
+
+def track_socket_event(name):
+    """Collect SQL stats, latency metrics and a trace span for one Socket.IO event handler"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            app = current_app._get_current_object()
+            token = start(f'socket:{name}') if _mode(app) != 'off' else None
+            span = tracing.start_span(f'socket {name}', parent=None, kind=tracing.KIND_SERVER)
+            outcome = 'error'
+            started = time.perf_counter()
+            try:
+                result = f(*args, **kwargs)
+                if result is False:
+                    outcome = 'rejected'
+                elif isinstance(result, dict) and result.get('error') == 'rate_limited':
+                    # dropped by rate_limit.socket_event before the handler ran
+                    outcome = 'rate_limited'
+                else:
+                    outcome = 'ok'
+                return result
+            finally:
+                if outcome != 'rate_limited':
+                    metrics.SOCKET_LATENCY.observe(time.perf_counter() - started, name)
+                metrics.SOCKET_EVENTS.inc(name, outcome)
+                span.set_attribute('outcome', outcome)
+                tracing.end_span(span)
+                if token is not None:
+                    _report(app, finish(token), endpoint=f'socket:{name}')
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(limit, name='block'):
+    """Fail if the wrapped code (including test-client requests) runs more than `limit` queries"""
+    token = start(name)
+    stats = _current.get()
+    try:
+        yield stats
+    finally:
+        finish(token)
+    if stats.count > limit:
+        raise QueryBudgetExceeded(
+            f"{name} ran {stats.count} queries (limit {limit}):\n" +
+            '\n'.join(f"{count}x {shape}" for shape, count in
+                      sorted(stats.shapes.items(), key=lambda item: item[1], reverse=True))
+        )
+
+
+def init_app(app):
+    global _listening
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 3)
+    if _mode(app) == 'off':
+        return
+
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+
+    @app.before_request
+    def _start_request_stats():
+        request.environ['sql_stats_token'] = start(f'{request.method} {request.path}')
+
+    @app.after_request
+    def _finish_request_stats(response):
+        token = request.environ.pop('sql_stats_token', None)
+        if token is None:
+            return response
+        if response.is_streamed:
+            # stream=ndjson and the export query while the body is being sent
+            endpoint = request.endpoint
+            response.call_on_close(lambda: _report(app, finish(token), endpoint=endpoint))
+            return response
+        stats = finish(token)
+        threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+        if _mode(app) == 'headers':
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = f'{stats.total_time * 1000:.2f}'
+            if stats.slowest:
+                duration, shape = stats.slowest[0]
+                response.headers['X-DB-Slowest'] = f'{duration * 1000:.2f}ms {shape[:120]}'
+            repeated = stats.repeated(threshold)
+            if repeated:
+                response.headers['X-DB-N-Plus-One'] = f'{repeated[0][1]}x {repeated[0][0][:120]}'
+        _report(app, stats, endpoint=request.endpoint)
+        return response
+
+    @app.teardown_request
+    def _discard_request_stats(exc):
+        # after_request is skipped when the view raises
+        token = request.environ.pop('sql_stats_token', None)
+        if token is not None:
+            finish(token)
@@ -0,0 +1,84 @@
+"""Fast JSON provider for API responses.
+
+Uses orjson when it is installed (``JSON_PROVIDER=auto``, the default) and the
+standard library otherwise. Either way:
+
+- datetimes/dates are serialized natively, so serializers can return the
+  column values as-is instead of calling strftime per row; the wire format is
+  unchanged (``2024-05-20 13:14:00`` / ``2024-05-20``)
+- non-ASCII text is written as UTF-8 instead of ``\\uXXXX`` escapes
+- keys are not sorted
+"""
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def default(o):
+    if isinstance(o, datetime):
+        return o.isoformat(' ', 'seconds')
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    ensure_ascii = False
+    sort_keys = False
+    default = staticmethod(default)
+
+    def dumps_bytes(self, obj):
+        return self.dumps(obj).encode('utf-8')
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    # orjson renders datetimes as ISO 8601 with a 'T' by default; pass them to
+    # default() instead to keep the existing format
+    option = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # indent/sort_keys etc.: not worth mapping onto orjson options
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=default, option=self.option)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+class SocketJSON:
+    """``json`` stand-in for python-socketio so event payloads get the same
+    datetime handling as HTTP responses"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def dumps(self, obj, **kwargs):
+        # python-socketio asks for compact separators; orjson output already is
+        return self.provider.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return self.provider.loads(s)
+
+
+def init_app(app):
+    """Install the provider selected by JSON_PROVIDER (auto / orjson / stdlib)"""
+    choice = app.config.setdefault('JSON_PROVIDER', 'auto')
+    if choice == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson but orjson is not installed")
+    use_orjson = orjson is not None and choice in ('auto', 'orjson')
+    app.json = (OrjsonProvider if use_orjson else StdlibJSONProvider)(app)
@@ -0,0 +1,120 @@
+"""Hot/cold split of chat messages.
+
+Messages older than ``MESSAGE_ARCHIVE_DAYS`` are moved from ``message`` to
+``message_archive`` so the hot table and its indexes stay small enough to
+live in the page cache. Each batch of ``MESSAGE_ARCHIVE_BATCH_SIZE`` rows is
+copied and deleted in one short transaction, with a pause between batches so
+chat writes are never blocked for long. Ids are kept, and
+get_chat_history() continues into the archive once a client pages back past
+the oldest hot message.
+
+``message`` is an AUTOINCREMENT table (migration 0004), so ids are never
+reused once the newest messages are recalled or archived. The newest message
+still stays in the hot table, for backends that restart their counter at
+max(id) + 1.
+
+The scheduler runs this every night for every couple; ``MESSAGE_ARCHIVE_DAYS=0``
+turns it off.
+
+Usage: python message_archive.py [--days 180] [--batch-size 1000]
+"""
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import metrics
+import tenancy
+import tracing
+from extensions import db
+from models import ArchivedMessage, Message
+
+ARCHIVE_COLUMNS = ('id', 'sender_id', 'content', 'timestamp')
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to `batch_size` messages older than `cutoff`; returns how many were moved"""
+    with tracing.span('message_archive.batch', batch_size=batch_size) as span:
+        newest_id = db.session.query(func.max(Message.id)).scalar()
+        if newest_id is None:
+            return 0
+        ids = db.session.execute(
+            db.select(Message.id)
+            .where(Message.timestamp < cutoff, Message.id < newest_id)
+            .order_by(Message.timestamp)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return 0
+        columns = [getattr(Message, name) for name in ARCHIVE_COLUMNS]
+        db.session.execute(
+            db.insert(ArchivedMessage).from_select(ARCHIVE_COLUMNS, db.select(*columns).where(Message.id.in_(ids)))
+        )
+        moved = db.session.execute(db.delete(Message).where(Message.id.in_(ids))).rowcount
+        db.session.commit()
+        span.set_attribute('moved', moved)
+        return moved
+
+
+def archive_messages(days, batch_size=1000, pause=0.05):
+    """Archive every message older than `days` days, batch by batch; needs an app context"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            return total
+        total += moved
+        metrics.MESSAGES_ARCHIVED.inc(amount=moved)
+        # let queued chat writes take the write lock between batches
+        time.sleep(pause)
+
+
+def run_scheduled(app):
+    """Nightly archival from the scheduler thread, once per couple"""
+    days = app.config['MESSAGE_ARCHIVE_DAYS']
+    if days <= 0:
+        return
+
+    def archive(couple_id):
+        moved = archive_messages(days, app.config['MESSAGE_ARCHIVE_BATCH_SIZE'],
+                                 app.config['MESSAGE_ARCHIVE_PAUSE_MS'] / 1000)
+        if moved:
+            suffix = f'（情侣 {couple_id}）' if couple_id is not None else ''
+            print(f"🗄️ 已归档 {moved} 条 {days} 天前的聊天消息{suffix}")
+
+    tenancy.for_each_couple(app, archive, '聊天消息归档')
+
+
+def init_app(app):
+    app.config.setdefault('MESSAGE_ARCHIVE_DAYS', 180)
+    app.config.setdefault('MESSAGE_ARCHIVE_BATCH_SIZE', 1000)
+    app.config.setdefault('MESSAGE_ARCHIVE_PAUSE_MS', 50)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='将旧聊天消息移入归档表')
+    parser.add_argument('--days', type=int, help='归档多少天前的消息（默认取 MESSAGE_ARCHIVE_DAYS）')
+    parser.add_argument('--batch-size', type=int, help='每批移动的条数')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    days = args.days if args.days is not None else app.config['MESSAGE_ARCHIVE_DAYS']
+    batch_size = args.batch_size or app.config['MESSAGE_ARCHIVE_BATCH_SIZE']
+
+    def archive(couple_id):
+        if couple_id is None:
+            db.create_all()
+        started = time.perf_counter()
+        moved = archive_messages(days, batch_size, app.config['MESSAGE_ARCHIVE_PAUSE_MS'] / 1000)
+        hot = db.session.query(func.count(Message.id)).scalar()
+        cold = db.session.query(func.count(ArchivedMessage.id)).scalar()
+        prefix = f'[情侣 {couple_id}] ' if couple_id is not None else ''
+        print(f"{prefix}归档 {moved} 条消息，用时 {time.perf_counter() - started:.1f}s；"
+              f"当前热表 {hot} 条，归档表 {cold} 条")
+
+    tenancy.for_each_couple(app, archive, '聊天消息归档')
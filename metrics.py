@@ -0,0 +1,287 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms are sharded per thread: the recording thread only
+touches its own shard, so the hot path takes no lock. Shards are summed when
+/metrics is scraped, and shards of finished threads are folded into a retired
+total so short-lived request threads don't accumulate.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+MAX_LIVE_SHARDS = 64
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _ShardedMetric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                if len(self._shards) >= MAX_LIVE_SHARDS:
+                    self._fold_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_dead_shards(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def _snapshot(self):
+        with self._lock:
+            self._fold_dead_shards()
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, dict(shard))
+        return total
+
+    def _merge(self, target, shard):
+        raise NotImplementedError
+
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def _merge(self, target, shard):
+        for key, value in list(shard.items()):
+            target[key] = target.get(key, 0) + value
+
+    def render(self):
+        for key, value in sorted(self._snapshot().items()):
+            yield f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+
+
+class Histogram(_ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        shard = self._shard()
+        state = shard.get(label_values)
+        if state is None:
+            # per-bucket (non-cumulative) counts, then +Inf, sum
+            state = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        else:
+            state[len(self.buckets)] += 1
+        state[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def _merge(self, target, shard):
+        for key, state in list(shard.items()):
+            merged = target.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(list(state)):
+                merged[i] += value
+
+    def render(self):
+        for key, state in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, key, (('le', bound),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, key)
+            yield f'{self.name}_sum{labels} {state[-1]!r}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge:
+    """Gauge set by rare events (connect/join), or computed at scrape time by `callback`"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        if self.callback is not None:
+            values = self.callback()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+
+
+def render_latest():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# HTTP and Socket.IO
+HTTP_REQUESTS = Counter('love_plane_http_requests_total', 'HTTP requests by endpoint and status',
+                        ('endpoint', 'method', 'status'))
+HTTP_LATENCY = Histogram('love_plane_http_request_duration_seconds', 'HTTP request latency',
+                         ('endpoint', 'method'))
+SOCKET_EVENTS = Counter('love_plane_socketio_events_total', 'Socket.IO events by outcome',
+                        ('event', 'outcome'))
+SOCKET_LATENCY = Histogram('love_plane_socketio_event_duration_seconds', 'Socket.IO handler latency',
+                           ('event',))
+SOCKET_CLIENTS = Gauge('love_plane_socketio_connected_clients', 'Connected Socket.IO clients')
+
+# Love One Day pipeline
+LLM_LATENCY = Histogram('love_plane_llm_request_duration_seconds', 'BaiLian API call latency per attempt',
+                        ('status',))
+LLM_RETRIES = Counter('love_plane_llm_retries_total', 'BaiLian API retries')
+LLM_RATE_LIMITED = Counter('love_plane_llm_rate_limited_total', 'BaiLian API 429 responses')
+BROADCAST_FALLBACKS = Counter('love_plane_broadcast_fallbacks_total', 'Broadcasts served from fallback text',
+                              ('broadcast_type',))
+TTS_LATENCY = Histogram('love_plane_tts_duration_seconds', 'TTS synthesis time', ('outcome',))
+SCHEDULER_RUNS = Counter('love_plane_scheduler_runs_total', 'Daily broadcast scheduler runs', ('outcome',))
+
+# Rate limiting and work queues
+RATE_LIMITED = Counter('love_plane_rate_limited_total', 'Events and requests rejected by per-user rate limits',
+                       ('event',))
+WORK_REJECTED = Counter('love_plane_work_queue_rejected_total', 'LLM/TTS calls rejected by a full work queue',
+                        ('queue',))
+
+# Chat
+MESSAGES_ARCHIVED = Counter('love_plane_messages_archived_total', 'Chat messages moved to the archive table')
+
+# Caches
+USER_PROFILE_LOOKUPS = Counter('love_plane_user_profile_lookups_total', 'User profile cache lookups',
+                               ('result',))
+
+
+_rooms_by_sid = {}
+_rooms_lock = threading.Lock()
+
+
+def _room_members():
+    counts = {}
+    with _rooms_lock:
+        for rooms in _rooms_by_sid.values():
+            for room in rooms:
+                counts[(room,)] = counts.get((room,), 0) + 1
+    return counts
+
+
+SOCKET_ROOM_MEMBERS = Gauge('love_plane_socketio_room_members', 'Clients joined to each Socket.IO room',
+                            ('room',), callback=_room_members)
+
+
+def socket_connected(sid):
+    SOCKET_CLIENTS.inc()
+    with _rooms_lock:
+        _rooms_by_sid[sid] = set()
+
+
+def socket_joined(sid, room):
+    with _rooms_lock:
+        _rooms_by_sid.setdefault(sid, set()).add(room)
+
+
+def socket_disconnected(sid):
+    SOCKET_CLIENTS.dec()
+    with _rooms_lock:
+        _rooms_by_sid.pop(sid, None)
+
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def init_app(app):
+    """Register /metrics and the HTTP timing hooks"""
+    from flask import Response, request
+
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('METRICS_PUBLIC', False)
+
+    @app.before_request
+    def _start_timer():
+        request.environ['metrics_start'] = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = request.environ.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_LATENCY.observe(time.perf_counter() - start, endpoint, request.method)
+            HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        # Per-route and per-event traffic is not public by default: scraping needs
+        # the token, or (without one) a loopback client unless METRICS_PUBLIC is set
+        token = app.config['METRICS_TOKEN']
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                return {'code': 401, 'msg': 'Authentication required'}, 401
+        elif not app.config['METRICS_PUBLIC'] and request.remote_addr not in LOOPBACK_ADDRESSES:
+            return {'code': 403, 'msg': 'Forbidden'}, 403
+        return Response(render_latest(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,168 @@
+"""Lightweight schema migrations for existing (live) SQLite databases.
+
+db.create_all() only creates missing tables; it never alters a table or its
+indexes. Each migration below runs once, inside its own transaction, and is
+recorded in the ``schema_migrations`` table. Migrations must be idempotent so
+they also succeed on databases freshly created from the current models.
+
+Usage: python migrations.py [--list]
+"""
+import sys
+import os
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+
+def _0001_anniversary_next_occurrence(conn):
+    columns = {c['name'] for c in inspect(conn).get_columns('anniversary')}
+    if 'next_occurrence' not in columns:
+        conn.execute(text('ALTER TABLE anniversary ADD COLUMN next_occurrence DATE'))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_anniversary_next_occurrence '
+        'ON anniversary (next_occurrence)'
+    ))
+
+
+def _0002_query_shaped_indexes(conn):
+    # Single-column indexes that were declared twice (index=True plus
+    # __table_args__) or are a prefix of one of the composites below.
+    for name in (
+        'ix_moment_timestamp', 'ix_moment_user_id',
+        'idx_moments_user_id', 'idx_moments_is_pinned',
+        'ix_comment_timestamp', 'ix_comment_moment_id',
+        'idx_comments_moment_id', 'idx_comments_timestamp',
+        'ix_like_user_id',
+        'ix_message_timestamp', 'ix_message_sender_id',
+        'idx_report_date',
+    ):
+        conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+    # index(): pinned moments of one user; pin count; feed filtered by user
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS idx_moments_user_pinned_timestamp '
+        'ON moment (user_id, is_pinned, timestamp)'
+    ))
+    # get_moments(): ORDER BY is_pinned DESC, timestamp DESC
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS idx_moments_pinned_timestamp '
+        'ON moment (is_pinned, timestamp)'
+    ))
+    # get_moment_comments(): WHERE moment_id = ? ORDER BY timestamp
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS idx_comments_moment_timestamp '
+        'ON comment (moment_id, timestamp)'
+    ))
+    conn.execute(text('ANALYZE'))
+
+
+def _0003_report_preview(conn):
+    from models import LoveOneDayReport
+
+    columns = {c['name'] for c in inspect(conn).get_columns('love_one_day_report')}
+    if 'preview' not in columns:
+        conn.execute(text('ALTER TABLE love_one_day_report ADD COLUMN preview VARCHAR(61)'))
+    # one report per day, so this is at most a few thousand rows
+    rows = conn.execute(text('SELECT id, content FROM love_one_day_report WHERE preview IS NULL')).all()
+    if rows:
+        conn.execute(
+            text('UPDATE love_one_day_report SET preview = :preview WHERE id = :id'),
+            [{'id': row.id, 'preview': LoveOneDayReport.make_preview(row.content)} for row in rows]
+        )
+
+
+def _0004_message_autoincrement(conn):
+    # Without AUTOINCREMENT SQLite hands out max(id) + 1, which reuses the ids
+    # of recalled and archived messages. SQLite can't alter a primary key, so
+    # the table is rebuilt, and the sequence starts above both tables.
+    if conn.dialect.name != 'sqlite':
+        return
+    create_sql = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'message'"
+    )).scalar()
+    if create_sql is None:
+        return
+    if 'AUTOINCREMENT' not in create_sql.upper():
+        conn.execute(text(
+            'CREATE TABLE message_new ('
+            'id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, '
+            'sender_id INTEGER NOT NULL, '
+            'content TEXT NOT NULL, '
+            'timestamp DATETIME, '
+            'FOREIGN KEY(sender_id) REFERENCES user (id))'
+        ))
+        conn.execute(text(
+            'INSERT INTO message_new (id, sender_id, content, timestamp) '
+            'SELECT id, sender_id, content, timestamp FROM message'
+        ))
+        conn.execute(text('DROP TABLE message'))
+        conn.execute(text('ALTER TABLE message_new RENAME TO message'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON message (timestamp)'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON message (sender_id)'))
+
+    highest = conn.execute(text('SELECT COALESCE(MAX(id), 0) FROM message')).scalar()
+    if 'message_archive' in inspect(conn).get_table_names():
+        highest = max(highest, conn.execute(text('SELECT COALESCE(MAX(id), 0) FROM message_archive')).scalar())
+    updated = conn.execute(
+        text("UPDATE sqlite_sequence SET seq = MAX(seq, :seq) WHERE name = 'message'"), {'seq': highest}
+    ).rowcount
+    if not updated:
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('message', :seq)"), {'seq': highest})
+
+
+MIGRATIONS = [
+    ('0001_anniversary_next_occurrence', _0001_anniversary_next_occurrence),
+    ('0002_query_shaped_indexes', _0002_query_shaped_indexes),
+    ('0003_report_preview', _0003_report_preview),
+    ('0004_message_autoincrement', _0004_message_autoincrement),
+]
+
+
+def _ensure_migrations_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'id VARCHAR(100) PRIMARY KEY, applied_at DATETIME NOT NULL)'
+        ))
+
+
+def applied_migrations(engine):
+    _ensure_migrations_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text('SELECT id FROM schema_migrations'))}
+
+
+def run_migrations(engine):
+    """Apply pending migrations in order; returns the ids that were applied"""
+    done = applied_migrations(engine)
+    applied = []
+    for migration_id, migrate in MIGRATIONS:
+        if migration_id in done:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text('INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :applied_at)'),
+                {'id': migration_id, 'applied_at': datetime.utcnow()}
+            )
+        print(f"Applied migration {migration_id}")
+        applied.append(migration_id)
+    return applied
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import create_app
+    from extensions import db
+
+    app = create_app()
+    with app.app_context():
+        if '--list' in sys.argv[1:]:
+            done = applied_migrations(db.engine)
+            for migration_id, _ in MIGRATIONS:
+                print(f"[{'x' if migration_id in done else ' '}] {migration_id}")
+        else:
+            db.create_all()
+            applied = run_migrations(db.engine)
+            if not applied:
+                print("Database schema is up to date")
@@ -0,0 +1,140 @@
+"""SQLAlchemy models"""
+import json
+from datetime import datetime, date
+
+from extensions import db
+
+REPORT_PREVIEW_LENGTH = 60
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    avatar = db.Column(db.String(200), default='/static/avatars/default.png')
+    token = db.Column(db.String(100), unique=True, nullable=False)  # 新增 token 字段
+    role = db.Column(db.String(20), nullable=False)  # 'male' or 'female'
+
+class Anniversary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(100), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    # Upcoming yearly recurrence of `date`, kept current by refresh_anniversary_occurrences()
+    next_occurrence = db.Column(db.Date, index=True)
+
+    @property
+    def days_count(self):
+        today = date.today()
+        delta = today - self.date
+        return delta.days
+
+    @staticmethod
+    def compute_next_occurrence(original, today=None):
+        """Next date (>= today) on which `original` recurs; Feb 29 falls back to Feb 28"""
+        today = today or date.today()
+        for year in (today.year, today.year + 1):
+            try:
+                candidate = original.replace(year=year)
+            except ValueError:
+                candidate = date(year, 2, 28)
+            if candidate >= today:
+                return candidate
+
+    @db.validates('date')
+    def _sync_next_occurrence(self, key, value):
+        self.next_occurrence = Anniversary.compute_next_occurrence(value)
+        return value
+
+class Moment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    images_json = db.Column(db.Text, default='[]')
+    is_pinned = db.Column(db.Boolean, default=False, nullable=False)
+
+    user = db.relationship('User', backref=db.backref('moments', lazy=True))
+    comments = db.relationship('Comment', backref='moment', lazy=True, cascade="all, delete-orphan")
+    likes = db.relationship('Like', backref='moment', lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('idx_moments_timestamp', 'timestamp'),
+        db.Index('idx_moments_user_pinned_timestamp', 'user_id', 'is_pinned', 'timestamp'),
+        db.Index('idx_moments_pinned_timestamp', 'is_pinned', 'timestamp'),
+    )
+
+    @property
+    def images(self):
+        return json.loads(self.images_json)
+
+    @images.setter
+    def images(self, value):
+        self.images_json = json.dumps(value)
+
+class Comment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    moment_id = db.Column(db.Integer, db.ForeignKey('moment.id'), nullable=False)
+    
+    user = db.relationship('User', backref=db.backref('comments', lazy=True))
+
+    __table_args__ = (
+        db.Index('idx_comments_moment_timestamp', 'moment_id', 'timestamp'),
+    )
+
+class Like(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    moment_id = db.Column(db.Integer, db.ForeignKey('moment.id'), nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('idx_likes_user_moment', 'user_id', 'moment_id', unique=True),
+    )
+
+class Message(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    sender = db.relationship('User', backref=db.backref('messages', lazy=True))
+
+    __table_args__ = (
+        db.Index('idx_messages_timestamp', 'timestamp'),
+        db.Index('idx_messages_sender_id', 'sender_id'),
+        # never reuse an id, even once the newest rows are recalled or archived:
+        # ids are shared with message_archive and are the history cursor
+        {'sqlite_autoincrement': True},
+    )
+
+class ArchivedMessage(db.Model):
+    """Cold storage for old chat messages, moved here by message_archive.py (ids are kept)"""
+    __tablename__ = 'message_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime)
+
+class LoveOneDayReport(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    report_date = db.Column(db.Date, unique=True, nullable=False, index=True)
+    content = db.Column(db.Text, nullable=False)
+    broadcast_type = db.Column(db.String(50), nullable=False)
+    audio_url = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    is_pushed = db.Column(db.Boolean, default=False)
+    # Excerpt of `content` shown in the history list, kept in sync by _sync_preview()
+    preview = db.Column(db.String(REPORT_PREVIEW_LENGTH + 1))
+
+    @staticmethod
+    def make_preview(content):
+        """First REPORT_PREVIEW_LENGTH characters of `content` on one line, with an ellipsis if cut"""
+        text = ' '.join((content or '').split())
+        if len(text) <= REPORT_PREVIEW_LENGTH:
+            return text
+        return text[:REPORT_PREVIEW_LENGTH].rstrip() + '…'
+
+    @db.validates('content')
+    def _sync_preview(self, key, value):
+        self.preview = LoveOneDayReport.make_preview(value)
+        return value
@@ -0,0 +1,179 @@
+"""Opt-in per-request profiler.
+
+A request is profiled when a logged-in user asks for it (``?profile=1`` or
+an ``X-Profile: 1`` header, if ``PROFILE_ON_DEMAND`` is on) or when it is
+picked by ``PROFILE_SAMPLE_RATE``. ``PROFILE_FORMAT`` selects the output:
+
+- ``pstats``: a cProfile dump, open with ``python profiler.py <file>`` or snakeviz
+- ``collapsed``: wall-clock stack samples in the collapsed-stack format read by
+  flamegraph.pl and speedscope (includes time spent waiting on the DB/network)
+
+Files go to ``PROFILE_DIR``; the oldest are deleted once the directory grows
+beyond ``PROFILE_MAX_MB``. When neither trigger is enabled no hooks are
+registered at all, otherwise an unprofiled request costs one header/arg
+lookup and a random() call.
+
+Usage: python profiler.py <file.prof> [--sort cumulative] [--limit 30]
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+PROFILE_FLAG_VALUES = ('1', 'true', 'yes')
+
+_UNSAFE_FILENAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class StackSampler:
+    """Sample one thread's stack from a background thread and count collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            key = ';'.join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+def enforce_size_cap(directory, max_bytes, keep=None):
+    """Delete the oldest profiles until the directory fits in `max_bytes`; `keep` is never deleted"""
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if path == keep:
+            continue
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _requested(app):
+    from flask import request, session
+    if not app.config['PROFILE_ON_DEMAND']:
+        return False
+    flag = request.headers.get('X-Profile') or request.args.get('profile')
+    return flag is not None and flag.lower() in PROFILE_FLAG_VALUES and bool(session.get('user_id'))
+
+
+def init_app(app):
+    app.config.setdefault('PROFILE_ON_DEMAND', False)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_FORMAT', 'pstats')
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config.setdefault('PROFILE_MAX_MB', 100)
+    app.config.setdefault('PROFILE_SAMPLE_INTERVAL_MS', 5)
+    if not app.config['PROFILE_ON_DEMAND'] and not app.config['PROFILE_SAMPLE_RATE']:
+        return
+
+    from flask import request
+
+    @app.before_request
+    def _start_profile():
+        sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        if not _requested(app) and not (sample_rate and random.random() < sample_rate):
+            return
+        if app.config['PROFILE_FORMAT'] == 'collapsed':
+            profile = StackSampler(threading.get_ident(), app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+            profile.start()
+        else:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler is already active on this thread
+                return
+        request.environ['profiler'] = (profile, time.perf_counter())
+
+    @app.after_request
+    def _finish_profile(response):
+        state = request.environ.pop('profiler', None)
+        if state is None:
+            return response
+        profile, started = state
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if isinstance(profile, StackSampler):
+            profile.stop()
+            extension = 'collapsed'
+        else:
+            profile.disable()
+            extension = 'prof'
+
+        directory = app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        endpoint = _UNSAFE_FILENAME.sub('_', request.endpoint or 'unmatched')
+        filename = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{request.method}-{endpoint}-{elapsed_ms:.0f}ms.{extension}"
+        path = os.path.join(directory, filename)
+        try:
+            if isinstance(profile, StackSampler):
+                profile.write(path)
+            else:
+                profile.dump_stats(path)
+            # the file just written is named in X-Profile-File, so it stays even if it alone exceeds the cap
+            enforce_size_cap(directory, app.config['PROFILE_MAX_MB'] * 1024 * 1024, keep=path)
+        except OSError as e:
+            print(f"Failed to write profile {path}: {e}")
+            return response
+        response.headers['X-Profile-File'] = filename
+        return response
+
+    @app.teardown_request
+    def _discard_profile(exc):
+        # after_request is skipped when the view raises
+        state = request.environ.pop('profiler', None)
+        if state is not None:
+            profile = state[0]
+            if isinstance(profile, StackSampler):
+                profile.stop()
+            else:
+                profile.disable()
+
+
+if __name__ == '__main__':
+    import argparse
+    import pstats
+
+    parser = argparse.ArgumentParser(description='打印 cProfile 结果')
+    parser.add_argument('file')
+    parser.add_argument('--sort', default='cumulative')
+    parser.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args()
+    pstats.Stats(args.file).strip_dirs().sort_stats(args.sort).print_stats(args.limit)
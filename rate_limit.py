@@ -0,0 +1,200 @@
+"""Per-user rate limits and bounded queues for expensive work.
+
+``RATE_LIMITS`` gives every limited event a token bucket per user, written as
+``'<count>/<period>'`` (``'20/10s'``: bursts of up to 20, refilled at 2 per
+second; periods take ``s``, ``m`` or ``h``). Over budget, a Socket.IO event
+is dropped and acked with ``{'error': 'rate_limited', 'retry_after': ...}``
+and an HTTP route answers ``429`` with ``Retry-After``.
+
+``WORK_QUEUES`` caps LLM and TTS calls made on behalf of requests:
+``(workers, waiting)`` calls may run or wait at once, and the next one is
+rejected with ``503`` instead of parking yet another thread behind them.
+"""
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from flask import current_app, request, session
+
+import metrics
+import tenancy
+import tracing
+
+DEFAULT_RATE_LIMITS = {
+    'message': '20/10s',
+    'typing': '10/5s',
+    'stop_typing': '10/5s',
+    'recall': '5/10s',
+    'love_one_day_generate': '3/1m',
+    'love_one_day_tts': '5/1m',
+}
+DEFAULT_WORK_QUEUES = {
+    'llm': (2, 4),
+    'tts': (2, 4),
+}
+QUEUE_RETRY_AFTER = 5
+MAX_BUCKETS = 10000
+
+_LIMIT_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smh])\s*$')
+_PERIOD_SECONDS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+class QueueFull(Exception):
+    def __init__(self, name):
+        super().__init__(f"{name} queue is full")
+        self.name = name
+
+
+def parse_limit(spec):
+    """'20/10s' -> (capacity 20, refill rate 2.0 per second)"""
+    match = _LIMIT_RE.match(spec)
+    if not match:
+        raise ValueError(f"Invalid rate limit {spec!r}, expected e.g. '20/10s'")
+    count, amount, unit = int(match.group(1)), int(match.group(2) or 1), match.group(3)
+    return count, count / (amount * _PERIOD_SECONDS[unit])
+
+
+def parse_settings(value):
+    """'message=20/10s,recall=5/10s' -> {'message': '20/10s', 'recall': '5/10s'}"""
+    settings = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, setting = item.partition('=')
+        settings[name.strip()] = setting.strip()
+    return settings
+
+
+def parse_queues(value):
+    """'llm=2:4,tts=1:2' -> {'llm': (2, 4), 'tts': (1, 2)}  (workers:waiting)"""
+    queues = {}
+    for name, setting in parse_settings(value).items():
+        workers, _, waiting = setting.partition(':')
+        queues[name] = (int(workers), int(waiting or 0))
+    return queues
+
+
+class RateLimiter:
+    """Token buckets keyed by (event, user); take() never blocks"""
+
+    def __init__(self, limits):
+        self.limits = {name: parse_limit(spec) for name, spec in limits.items()}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, name, key):
+        """0 if the event may proceed, otherwise seconds until a token is available"""
+        limit = self.limits.get(name)
+        if limit is None:
+            return 0
+        capacity, rate = limit
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get((name, key), (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[(name, key)] = (tokens, now)
+                return (1 - tokens) / rate
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            self._buckets[(name, key)] = (tokens - 1, now)
+            return 0
+
+    def _prune(self, now):
+        # buckets that have refilled completely are the same as no bucket
+        for bucket_key, (tokens, updated) in list(self._buckets.items()):
+            capacity, rate = self.limits[bucket_key[0]]
+            if tokens + (now - updated) * rate >= capacity:
+                del self._buckets[bucket_key]
+
+
+class WorkQueue:
+    """At most `workers` calls run at once and `waiting` more wait; the rest are rejected"""
+
+    def __init__(self, name, workers, waiting):
+        self.name = name
+        self.capacity = workers + waiting
+        self._slots = threading.BoundedSemaphore(workers)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            if self._pending >= self.capacity:
+                metrics.WORK_REJECTED.inc(self.name)
+                raise QueueFull(self.name)
+            self._pending += 1
+        try:
+            with tracing.span('work_queue.wait', queue=self.name):
+                self._slots.acquire()
+            try:
+                yield
+            finally:
+                self._slots.release()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+def _client_key():
+    # user ids are only unique within a couple
+    return (tenancy.current_couple_id(), session.get('user_id') or session.get('token') or request.remote_addr)
+
+
+def _retry_after(app, name):
+    limiter = app.extensions.get('rate_limiter')
+    return limiter.take(name, _client_key()) if limiter is not None else 0
+
+
+def socket_event(name):
+    """Drop the event with an error ack when the sender is over the `name` budget"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            retry_after = _retry_after(current_app, name)
+            if retry_after:
+                metrics.RATE_LIMITED.inc(name)
+                return {'error': 'rate_limited', 'retry_after': round(retry_after, 2)}
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def route(name):
+    """Answer 429 with Retry-After when the user is over the `name` budget"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            retry_after = _retry_after(current_app, name)
+            if retry_after:
+                metrics.RATE_LIMITED.inc(name)
+                return ({'code': 429, 'msg': '请求过于频繁，请稍后再试'}, 429,
+                        {'Retry-After': str(math.ceil(retry_after))})
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def work_slot(name):
+    """Context manager holding a slot of the `name` work queue; raises QueueFull"""
+    queue = current_app.extensions['work_queues'].get(name)
+    return queue.slot() if queue is not None else nullcontext()
+
+
+def busy_response():
+    return ({'code': 503, 'msg': '服务繁忙，请稍后再试'}, 503,
+            {'Retry-After': str(QUEUE_RETRY_AFTER)})
+
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMIT_ENABLED', True)
+    app.config.setdefault('RATE_LIMITS', {})
+    app.config.setdefault('WORK_QUEUES', {})
+    if app.config['RATE_LIMIT_ENABLED']:
+        app.extensions['rate_limiter'] = RateLimiter({**DEFAULT_RATE_LIMITS, **app.config['RATE_LIMITS']})
+    queues = {**DEFAULT_WORK_QUEUES, **app.config['WORK_QUEUES']}
+    app.extensions['work_queues'] = {
+        name: WorkQueue(name, workers, waiting) for name, (workers, waiting) in queues.items()
+    }
@@ -1,8 +1,11 @@
-from app import app, db, Anniversary, User, Moment
+from app import create_app
+from extensions import db
+from models import Anniversary, User, Moment
 from datetime import date, timedelta, datetime
 import os
 
-def seed_data():
+def seed_data(app=None):
+    app = app or create_app()
     with app.app_context():
         # Drop all tables to reset schema
         db.drop_all()
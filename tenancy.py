@@ -0,0 +1,244 @@
+"""Multi-couple tenancy.
+
+With ``TENANCY`` off (the default) the app serves one couple from
+``SQLALCHEMY_DATABASE_URI`` and everything below is a no-op: the current
+couple is ``None`` and the Socket.IO room is ``couple_room``.
+
+With ``TENANCY=1``:
+
+- a small directory database (``TENANT_DIRECTORY_URI``) maps every login
+  token to a couple id; lookups are cached in memory
+- login stores the couple id in the session, and ``db.session`` is routed to
+  that couple's own SQLite file in ``TENANT_SHARD_DIR`` by
+  db_profile.ShardRouter, so every query is scoped to one couple without a
+  ``couple_id`` column anywhere
+- each couple gets its own Socket.IO room, whatever room the client asks for
+- scheduled jobs run once per couple on a pool of ``TENANT_WORKERS`` threads
+  (for_each_couple)
+
+Manage couples with:
+    python tenancy.py create "Boy & Girl" --user Boy:ck:male --user Girl:wkl:female
+    python tenancy.py adopt love_plane.db     # move an existing single-couple database in
+    python tenancy.py list
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, session
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData, String, Table,
+                        create_engine, func, select)
+
+import tracing
+
+DEFAULT_ROOM = 'couple_room'
+TOKEN_CACHE_SIZE = 10000
+
+_UNSET = object()
+
+directory_metadata = MetaData()
+couples = Table(
+    'couple', directory_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100)),
+    Column('created_at', DateTime, default=datetime.utcnow),
+)
+couple_tokens = Table(
+    'couple_token', directory_metadata,
+    Column('token', String(100), primary_key=True),
+    Column('couple_id', Integer, ForeignKey('couple.id'), nullable=False, index=True),
+)
+
+
+class Directory:
+    """Token -> couple id mapping, with an LRU cache in front of the directory database"""
+
+    def __init__(self, uri):
+        self.engine = create_engine(uri)
+        directory_metadata.create_all(self.engine)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def couple_for_token(self, token):
+        with self._lock:
+            if token in self._cache:
+                self._cache.move_to_end(token)
+                return self._cache[token]
+        with self.engine.connect() as conn:
+            couple_id = conn.execute(
+                select(couple_tokens.c.couple_id).where(couple_tokens.c.token == token)
+            ).scalar()
+        if couple_id is not None:
+            with self._lock:
+                self._cache[token] = couple_id
+                while len(self._cache) > TOKEN_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return couple_id
+
+    def couple_ids(self):
+        with self.engine.connect() as conn:
+            return list(conn.execute(select(couples.c.id).order_by(couples.c.id)).scalars())
+
+    def create_couple(self, name, tokens):
+        with self.engine.begin() as conn:
+            couple_id = conn.execute(couples.insert().values(name=name)).inserted_primary_key[0]
+            if tokens:
+                conn.execute(couple_tokens.insert(), [{'token': t, 'couple_id': couple_id} for t in tokens])
+        return couple_id
+
+    def list_couples(self):
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(couples.c.id, couples.c.name, couples.c.created_at,
+                       func.count(couple_tokens.c.token).label('tokens'))
+                .outerjoin(couple_tokens).group_by(couples.c.id).order_by(couples.c.id)
+            ).all()
+
+
+def is_enabled(app=None):
+    return (app or current_app).extensions.get('tenant_directory') is not None
+
+
+def couple_for_token(token):
+    directory = current_app.extensions.get('tenant_directory')
+    return directory.couple_for_token(token) if directory is not None else None
+
+
+def token_matches_couple(token):
+    """Whether `token` belongs to the couple selected for this request"""
+    if not is_enabled():
+        return True
+    couple_id = couple_for_token(token)
+    return couple_id is not None and couple_id == current_couple_id()
+
+
+def current_couple_id():
+    """Couple of the current job or request (None when tenancy is off)"""
+    if 'couple_id' in g:
+        return g.couple_id
+    if has_request_context():
+        return session.get('couple_id')
+    return None
+
+
+def select_couple(couple_id):
+    """Route this app context's queries to `couple_id` (before the first query)"""
+    g.couple_id = couple_id
+
+
+@contextmanager
+def use_couple(couple_id):
+    previous = g.get('couple_id', _UNSET)
+    g.couple_id = couple_id
+    try:
+        yield
+    finally:
+        if previous is _UNSET:
+            g.pop('couple_id', None)
+        else:
+            g.couple_id = previous
+
+
+def couple_room(couple_id=_UNSET):
+    if couple_id is _UNSET:
+        couple_id = current_couple_id()
+    return DEFAULT_ROOM if couple_id is None else f'couple_{couple_id}'
+
+
+def couple_ids(app):
+    directory = app.extensions.get('tenant_directory')
+    return directory.couple_ids() if directory is not None else [None]
+
+
+def for_each_couple(app, job, label='job'):
+    """Run job(couple_id) for every couple, each in its own app context, on the tenant pool"""
+    parent = tracing.current_span()
+
+    def run(couple_id):
+        try:
+            with app.app_context(), tracing.span('tenancy.couple_job', parent=parent, job=label,
+                                                 **{'couple.id': couple_id}):
+                select_couple(couple_id)
+                job(couple_id)
+        except Exception as e:
+            suffix = f' (couple {couple_id})' if couple_id is not None else ''
+            print(f"❌ {label}失败{suffix}: {e}")
+            return False
+        return True
+
+    ids = couple_ids(app)
+    if len(ids) == 1:
+        return [run(ids[0])]
+    with ThreadPoolExecutor(app.config['TENANT_WORKERS'], thread_name_prefix='tenant') as pool:
+        return list(pool.map(run, ids))
+
+
+def init_app(app):
+    app.config.setdefault('TENANCY', False)
+    app.config.setdefault('TENANT_DIRECTORY_URI', f"sqlite:///{os.path.join(app.instance_path, 'tenants.db')}")
+    app.config.setdefault('TENANT_SHARD_DIR', os.path.join(app.instance_path, 'shards'))
+    app.config.setdefault('TENANT_MAX_OPEN_SHARDS', 128)
+    app.config.setdefault('TENANT_SHARD_POOL_SIZE', 2)
+    app.config.setdefault('TENANT_WORKERS', 8)
+    if not app.config['TENANCY']:
+        return
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.extensions['tenant_directory'] = Directory(app.config['TENANT_DIRECTORY_URI'])
+
+
+if __name__ == '__main__':
+    import argparse
+    import sqlite3
+    import sys
+
+    parser = argparse.ArgumentParser(description='管理情侣租户（需 TENANCY=1）')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='新建一对情侣及其分片数据库')
+    create.add_argument('name')
+    create.add_argument('--user', action='append', required=True, metavar='NAME:TOKEN:ROLE',
+                        help='可重复，如 Boy:ck:male')
+    adopt = commands.add_parser('adopt', help='把现有的单对情侣 SQLite 数据库迁入为一个新租户')
+    adopt.add_argument('database')
+    adopt.add_argument('--name')
+    commands.add_parser('list', help='列出所有情侣')
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from models import User
+
+    app = create_app({'TENANCY': True})
+    directory = app.extensions['tenant_directory']
+    router = app.extensions['shard_router']
+
+    if args.command == 'list':
+        for row in directory.list_couples():
+            print(f"{row.id:>6}  {row.name or '-':<30} tokens={row.tokens}  {router.shard_path(row.id)}")
+        sys.exit(0)
+
+    if args.command == 'create':
+        users = [spec.split(':') for spec in args.user]
+        if any(len(parts) != 3 for parts in users):
+            parser.error('--user 格式为 NAME:TOKEN:ROLE')
+        couple_id = directory.create_couple(args.name, [token for _, token, _ in users])
+        with app.app_context():
+            select_couple(couple_id)
+            for name, token, role in users:
+                db.session.add(User(name=name, token=token, role=role))
+            db.session.commit()
+    else:
+        source = sqlite3.connect(args.database)
+        tokens = [row[0] for row in source.execute('SELECT token FROM user')]
+        couple_id = directory.create_couple(args.name or os.path.basename(args.database), tokens)
+        os.makedirs(os.path.dirname(router.shard_path(couple_id)), exist_ok=True)
+        with sqlite3.connect(router.shard_path(couple_id)) as target:
+            source.backup(target)
+        source.close()
+        with app.app_context():
+            select_couple(couple_id)
+            # brings the copied schema up to date
+            db.session.execute(db.select(User.id).limit(1))
+    print(f"✅ 情侣 {couple_id} 已创建，分片：{router.shard_path(couple_id)}")
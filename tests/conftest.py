@@ -0,0 +1,32 @@
+"""Shared fixtures: an application on a throwaway SQLite file with the full schema."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from extensions import db  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+
+@pytest.fixture
+def app_config():
+    """Extra configuration for the `app` fixture; override it in a test module"""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'SQL_INSTRUMENTATION': 'off',
+        'RATE_LIMIT_ENABLED': False,
+        **app_config,
+    })
+    with app.app_context():
+        db.create_all()
+        run_migrations(db.engine)
+    return app
@@ -0,0 +1,53 @@
+"""Cassettes recorded by ai_stub.py replay on other days."""
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai_stub  # noqa: E402
+from ai_service import LoveOneDayService  # noqa: E402
+
+
+@pytest.fixture
+def stubs():
+    servers = []
+
+    def start(**options):
+        server = ai_stub.serve(ai_stub.StubOptions(**options))
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def generate(monkeypatch, server, day):
+    monkeypatch.setenv('BAILIAN_API_KEY', 'stub')
+    monkeypatch.setenv('BAILIAN_ENDPOINT', f'{server.url}/v1/chat/completions')
+    return LoveOneDayService._generate_historical_events_broadcast({}, day, allow_fallback=False)
+
+
+def test_cassette_recorded_on_one_day_replays_on_another(stubs, monkeypatch, tmp_path):
+    cassette = str(tmp_path / 'cassette.jsonl')
+    upstream = stubs()
+    recorder = stubs(mode='record', cassette=cassette, upstream=f'{upstream.url}/v1/chat/completions')
+    recorded = generate(monkeypatch, recorder, date(2026, 6, 1))
+
+    player = stubs(mode='replay', cassette=cassette, replay_miss='error')
+    assert generate(monkeypatch, player, date(2026, 10, 19)) == recorded
+    assert player.snapshot()['replay_misses'] == 0
+
+
+def test_request_key_masks_dates_and_the_historical_event():
+    def body(day, event):
+        prompt = f'今天是{day}。\n\n在历史上的今天，曾发生过这样的事情：\n{event}\n\n请生成'
+        return {'messages': [{'role': 'user', 'content': prompt}]}
+
+    key = ai_stub.request_key('chat', body('2026年06月01日', '1910年 - 英国国王乔治五世加冕'))
+    assert key == ai_stub.request_key('chat', body('2026年10月19日', '10月19日是特殊的日子，见证了许多历史时刻'))
+    assert key != ai_stub.request_key('chat', {'messages': [{'role': 'user', 'content': '今天是2026年06月01日。'}]})
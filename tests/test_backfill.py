@@ -0,0 +1,64 @@
+"""--force regenerates every date once, even after a normal backfill."""
+import os
+import sys
+from datetime import date
+from itertools import count
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backfill_reports  # noqa: E402
+from ai_service import LoveOneDayService  # noqa: E402
+from models import LoveOneDayReport  # noqa: E402
+
+START, END = date(2026, 3, 1), date(2026, 3, 3)
+
+
+@pytest.fixture
+def run(app, tmp_path, monkeypatch):
+    versions = count(1)
+    monkeypatch.setattr(backfill_reports, 'app', app)
+    monkeypatch.setattr(LoveOneDayService, 'generate_love_broadcast',
+                        staticmethod(lambda data, allow_fallback=True: f'播报 v{next(versions)}'))
+    monkeypatch.setattr(LoveOneDayService, 'rate_limiter', None)
+    state_file = str(tmp_path / 'backfill_state.json')
+
+    def run(**options):
+        assert backfill_reports.backfill(START, END, workers=1, rate=1000, state_file=state_file, **options)
+        with app.app_context():
+            return {r.report_date: r.content for r in LoveOneDayReport.query}
+
+    return run
+
+
+def test_force_regenerates_dates_a_normal_run_completed(run):
+    first = run()
+    assert sorted(first) == [date(2026, 3, 1), date(2026, 3, 2), date(2026, 3, 3)]
+    assert run() == first
+
+    forced = run(force=True)
+    assert sorted(forced) == sorted(first)
+    assert not set(forced.values()) & set(first.values())
+
+    # a finished forced run doesn't stop the next one from redoing everything
+    assert not set(run(force=True).values()) & set(forced.values())
+
+
+def test_force_resumes_only_its_own_interrupted_run(run, monkeypatch):
+    run()
+    original_save = backfill_reports.save_report
+
+    def interrupt_on_last_day(result):
+        if result['date'] == END:
+            raise KeyboardInterrupt
+        original_save(result)
+
+    monkeypatch.setattr(backfill_reports, 'save_report', interrupt_on_last_day)
+    with pytest.raises(KeyboardInterrupt):
+        run(force=True)
+    monkeypatch.setattr(backfill_reports, 'save_report', original_save)
+
+    resumed = run(force=True)
+    assert resumed[END] == '播报 v7'
+    assert [resumed[date(2026, 3, 1)], resumed[date(2026, 3, 2)]] == ['播报 v4', '播报 v5']
@@ -0,0 +1,82 @@
+"""Message ids stay unique across the hot and the archive table."""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from extensions import db, socketio  # noqa: E402
+from message_archive import archive_messages  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from models import ArchivedMessage, Message, User  # noqa: E402
+
+
+@pytest.fixture
+def boy(app):
+    with app.app_context():
+        db.session.add(User(id=1, name='Boy', token='ck', role='male'))
+        db.session.commit()
+
+
+def socket_client(app, token='ck'):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['token'] = token
+        session['user_id'] = 1
+    sio = socketio.test_client(app, flask_test_client=client)
+    sio.emit('join', {'room': 'couple_room'})
+    return client, sio
+
+
+def test_recalling_last_hot_message_after_archiving_does_not_reuse_ids(app, boy):
+    old = datetime.utcnow() - timedelta(days=365)
+    with app.app_context():
+        for i in range(5):
+            db.session.add(Message(sender_id=1, content=f'old {i}', timestamp=old + timedelta(minutes=i)))
+        db.session.commit()
+        assert archive_messages(days=180, pause=0) == 4
+        hot_ids = [row.id for row in db.session.query(Message.id)]
+        archived_ids = {row.id for row in db.session.query(ArchivedMessage.id)}
+    assert hot_ids == [5]
+
+    client, sio = socket_client(app)
+    sio.emit('recall', {'id': 5})
+    with app.app_context():
+        assert db.session.query(Message.id).count() == 0
+
+    sio.get_received()
+    sio.emit('message', {'content': 'new'})
+    new_id = sio.get_received()[-1]['args'][0]['id']
+    assert new_id > 5
+    assert new_id not in archived_ids
+
+    items = client.get('/api/chat/history?limit=10').json['items']
+    ids = [item['id'] for item in items]
+    assert ids == sorted(set(ids), reverse=True)
+    assert ids == [new_id, 4, 3, 2, 1]
+
+
+def test_migration_rebuilds_legacy_message_table_above_archived_ids(tmp_path):
+    path = tmp_path / 'legacy.db'
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE message (id INTEGER NOT NULL PRIMARY KEY, sender_id INTEGER NOT NULL, '
+                          'content TEXT NOT NULL, timestamp DATETIME)'))
+        conn.execute(text('CREATE TABLE message_archive (id INTEGER NOT NULL PRIMARY KEY, '
+                          'sender_id INTEGER NOT NULL, content TEXT NOT NULL, timestamp DATETIME)'))
+        conn.execute(text("INSERT INTO message_archive VALUES (7, 1, 'archived', NULL)"))
+        conn.execute(text("INSERT INTO message VALUES (2, 1, 'hot', NULL)"))
+    engine.dispose()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SQL_INSTRUMENTATION': 'off'})
+    with app.app_context():
+        db.create_all()
+        run_migrations(db.engine)
+        db.session.add(Message(sender_id=1, content='next'))
+        db.session.commit()
+        ids = [row.id for row in db.session.query(Message.id).order_by(Message.id)]
+    assert ids == [2, 8]
@@ -0,0 +1,90 @@
+"""Query budgets of the list endpoints: a new N+1 fails here instead of in production."""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extensions import db  # noqa: E402
+from instrumentation import QueryBudgetExceeded, assert_max_queries  # noqa: E402
+from models import Comment, Like, Message, Moment, User  # noqa: E402
+
+# token check + the page's own queries + one user_cache lookup on a cold cache
+BUDGETS = {
+    'main.get_moments': 5,
+    'main.get_moment_comments': 4,
+    'main.get_chat_history': 4,
+}
+
+
+@pytest.fixture
+def app_config():
+    return {'SQL_INSTRUMENTATION': 'headers', 'SQL_QUERY_BUDGETS': BUDGETS}
+
+
+def seed(app, moments):
+    start = datetime(2026, 1, 1)
+    with app.app_context():
+        db.session.add(User(id=1, name='Boy', token='ck', role='male'))
+        db.session.add(User(id=2, name='Girl', token='wkl', role='female'))
+        for i in range(moments):
+            moment = Moment(content=f'moment {i}', user_id=1 + i % 2, timestamp=start + timedelta(minutes=i))
+            db.session.add(moment)
+            db.session.flush()
+            for j in range(3):
+                db.session.add(Comment(content='comment', user_id=1 + j % 2, moment_id=moment.id,
+                                       timestamp=start + timedelta(minutes=i, seconds=j)))
+            db.session.add(Like(user_id=2, moment_id=moment.id))
+            db.session.add(Message(sender_id=1 + i % 2, content='hi', timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+
+
+def login(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['token'] = 'ck'
+        session['user_id'] = 1
+    return client
+
+
+def user_cache_cleared(app):
+    app.extensions['user_cache'].clear()
+
+
+@pytest.mark.parametrize('url, endpoint', [
+    ('/api/moments?comments=3', 'main.get_moments'),
+    ('/api/moments?comments=3&users=1', 'main.get_moments'),
+    ('/api/moments/1/comments', 'main.get_moment_comments'),
+    ('/api/chat/history', 'main.get_chat_history'),
+    ('/api/chat/history?users=1', 'main.get_chat_history'),
+])
+@pytest.mark.parametrize('moments', [3, 20])
+def test_endpoint_stays_within_its_budget(app, url, endpoint, moments):
+    seed(app, moments)
+    client = login(app)
+    user_cache_cleared(app)
+    with assert_max_queries(BUDGETS[endpoint], name=url):
+        response = client.get(url)
+    assert response.status_code == 200
+    assert int(response.headers['X-DB-Query-Count']) <= BUDGETS[endpoint]
+
+
+def test_exceeding_a_budget_fails_the_request(app):
+    seed(app, 3)
+    client = login(app)
+    app.config['SQL_QUERY_BUDGETS'] = {'main.get_chat_history': 1}
+    with pytest.raises(QueryBudgetExceeded, match='budget 1'):
+        client.get('/api/chat/history')
+
+
+def test_streamed_responses_are_counted_against_the_budget(app):
+    seed(app, 3)
+    client = login(app)
+    response = client.get('/api/moments?stream=ndjson')
+    assert len(response.data.splitlines()) == 3
+
+    app.config['SQL_QUERY_BUDGETS'] = {'main.get_moments': 1}
+    with pytest.raises(QueryBudgetExceeded, match='budget 1'):
+        client.get('/api/moments?stream=ndjson').close()
@@ -0,0 +1,26 @@
+"""Broadcast history month buckets."""
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extensions import db  # noqa: E402
+from models import LoveOneDayReport, User  # noqa: E402
+
+
+def test_history_months_counts_reports_per_month(app):
+    with app.app_context():
+        db.session.add(User(id=1, name='Boy', token='ck', role='male'))
+        for day in (date(2025, 12, 31), date(2026, 3, 1), date(2026, 3, 2)):
+            db.session.add(LoveOneDayReport(report_date=day, content='播报', broadcast_type='historical_events'))
+        db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['token'] = 'ck'
+        session['user_id'] = 1
+    months = client.get('/api/love-one-day/history/months').json['data']['months']
+    assert months == [{'month': '2026-03', 'count': 2}, {'month': '2025-12', 'count': 1}]
+    months = client.get('/api/love-one-day/history/months?order=asc').json['data']['months']
+    assert [bucket['month'] for bucket in months] == ['2025-12', '2026-03']
@@ -0,0 +1,60 @@
+"""Shard engines are opened without blocking other couples and retired safely."""
+import os
+import sys
+import threading
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_profile import ShardRouter  # noqa: E402
+from extensions import db  # noqa: E402
+import models  # noqa: E402,F401
+
+
+def make_router(tmp_path, max_open=4):
+    return ShardRouter(str(tmp_path), db.metadata, max_open=max_open, pool_size=2, busy_timeout_ms=1000)
+
+
+def test_evicted_engine_is_disposed_only_once_idle(tmp_path):
+    router = make_router(tmp_path, max_open=1)
+    first = router.engine_for(1)
+    conn = first.connect()
+    conn.execute(text('SELECT 1'))
+
+    router.engine_for(2)
+    assert 1 not in router._engines
+    assert router._retired == [first]
+    conn.execute(text('SELECT count(*) FROM message'))
+    conn.close()
+
+    router.engine_for(3)
+    assert router._retired == []
+    assert router._open_locks == {}
+    router.dispose()
+
+
+def test_migrating_one_shard_does_not_block_another(tmp_path, monkeypatch):
+    router = make_router(tmp_path)
+    opening = threading.Event()
+    release = threading.Event()
+    original_open = ShardRouter._open
+
+    def slow_open(self, couple_id):
+        if couple_id == 1:
+            opening.set()
+            assert release.wait(5)
+        return original_open(self, couple_id)
+
+    monkeypatch.setattr(ShardRouter, '_open', slow_open)
+    worker = threading.Thread(target=router.engine_for, args=(1,))
+    worker.start()
+    assert opening.wait(5)
+    try:
+        assert router.engine_for(2) is router.engine_for(2)
+    finally:
+        release.set()
+        worker.join(5)
+    assert set(router._engines) == {1, 2}
+    assert router._open_locks == {}
+    router.dispose()
@@ -0,0 +1,66 @@
+"""The user profile cache stays bounded and remembers unknown ids briefly."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_cache  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User  # noqa: E402
+from user_cache import UserCache  # noqa: E402
+
+
+def profile_of(user_id):
+    return {'id': user_id, 'name': f'u{user_id}', 'avatar': None}
+
+
+def test_least_recently_used_entries_are_evicted_on_insert():
+    cache = UserCache(ttl=300, max_entries=2, negative_ttl=30)
+    cache.set_many(None, {1: profile_of(1), 2: profile_of(2)})
+    cache.get_many(None, [1])
+    cache.set_many(None, {3: profile_of(3)})
+
+    found, missing = cache.get_many(None, [1, 2, 3])
+    assert sorted(found) == [1, 3]
+    assert missing == [2]
+    assert len(cache._entries) == 2
+
+
+def test_unknown_ids_expire_after_the_negative_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(user_cache.time, 'monotonic', lambda: now[0])
+    cache = UserCache(ttl=300, max_entries=10, negative_ttl=30)
+    cache.set_many(None, {}, unknown=[9])
+
+    assert cache.get_many(None, [9]) == ({}, [])
+    now[0] += 31
+    assert cache.get_many(None, [9]) == ({}, [9])
+    assert not cache._entries
+
+
+@pytest.fixture
+def boy(app):
+    with app.app_context():
+        db.session.add(User(id=1, name='Boy', token='ck', role='male'))
+        db.session.commit()
+
+
+def test_unknown_user_is_not_reloaded_until_it_is_created(app, boy, monkeypatch):
+    loads = []
+    original_load = user_cache._load
+    monkeypatch.setattr(user_cache, '_load', lambda ids: loads.append(sorted(ids)) or original_load(ids))
+
+    with app.test_request_context():
+        assert set(user_cache.profiles([1, 2])) == {1}
+    with app.test_request_context():
+        assert set(user_cache.profiles([1, 2])) == {1}
+    assert loads == [[1, 2]]
+
+    with app.app_context():
+        db.session.add(User(id=2, name='Girl', token='wkl', role='female'))
+        db.session.commit()
+    with app.test_request_context():
+        assert user_cache.profile(2)['name'] == 'Girl'
+    assert loads == [[1, 2], [2]]
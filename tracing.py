@@ -0,0 +1,304 @@
+"""Lightweight tracing with nested, timed spans.
+
+With ``TRACING`` on, every HTTP request and Socket.IO event is a root span,
+and the Love One Day pipeline opens child spans for each step: data
+collection, prompt building, every BaiLian attempt and backoff sleep, the
+database insert and TTS. The scheduler and batch jobs start their own traces.
+
+    with tracing.span('bailian.attempt', attempt=1) as span:
+        ...
+        span.set_attribute('http.response.status_code', 200)
+
+The current span is kept in a context variable. Thread pools don't inherit
+it, so capture ``current_span()`` before submitting work and pass it as
+``parent=``.
+
+Finished spans are appended to ``TRACE_FILE``, one line per span, in the
+OTLP/JSON shape (``{"resourceSpans": [...]}``) that the OpenTelemetry
+Collector's otlpjsonfile receiver reads. The file is rotated to
+``TRACE_FILE.1`` once it grows beyond ``TRACE_MAX_MB``. When ``TRACING`` is
+off, span() yields a shared no-op span and nothing is recorded.
+
+Usage: python tracing.py [instance/traces.jsonl] [--limit 20]
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+SERVICE_NAME = 'love-plane'
+
+# OTLP enum values
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar('trace_span', default=None)
+_exporter = None
+_CURRENT = object()
+
+
+class Span:
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns',
+                 'attributes', 'events', 'status', 'status_message', 'token')
+
+    def __init__(self, name, parent, kind, attributes):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else f'{random.getrandbits(128):032x}'
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.events = []
+        self.status = 0
+        self.status_message = None
+        self.token = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, exc):
+        self.add_event('exception', **{'exception.type': type(exc).__name__,
+                                       'exception.message': str(exc)})
+        self.set_error(str(exc))
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        if self.events:
+            span['events'] = [
+                {'timeUnixNano': str(at), 'name': name, 'attributes': _otlp_attributes(attributes)}
+                for name, at, attributes in self.events
+            ]
+        return span
+
+
+class _NoopSpan:
+    """Returned by span() when tracing is off"""
+    trace_id = span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # int64 is a string in OTLP/JSON
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class FileExporter:
+    """Append finished spans to a JSON-lines file, one OTLP export request per line"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._resource = {'attributes': _otlp_attributes({'service.name': SERVICE_NAME,
+                                                          'process.pid': os.getpid()})}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span):
+        line = json.dumps({'resourceSpans': [{
+            'resource': self._resource,
+            'scopeSpans': [{'scope': {'name': 'love_plane.tracing'}, 'spans': [span.to_otlp()]}],
+        }]}, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            if self.max_bytes and self._file.tell() > self.max_bytes:
+                self._file.close()
+                os.replace(self.path, self.path + '.1')
+                self._file = None
+
+
+def is_enabled():
+    return _exporter is not None
+
+
+def current_span():
+    return _current.get()
+
+
+def set_attributes(**attributes):
+    """Set attributes on the current span, if any"""
+    current = _current.get()
+    if current is not None:
+        current.set_attributes(**attributes)
+
+
+@contextmanager
+def span(name, parent=_CURRENT, kind=KIND_INTERNAL, **attributes):
+    """Time the block as a child of `parent` (the current span by default)"""
+    if _exporter is None:
+        yield NOOP_SPAN
+        return
+    if parent is _CURRENT:
+        parent = _current.get()
+    current = Span(name, parent, kind, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end_ns = time.time_ns()
+        _exporter.export(current)
+
+
+def start_span(name, parent=_CURRENT, kind=KIND_INTERNAL, **attributes):
+    """Open a span without a with-block; close it with end_span()"""
+    if _exporter is None:
+        return NOOP_SPAN
+    if parent is _CURRENT:
+        parent = _current.get()
+    current = Span(name, parent, kind, attributes)
+    current.token = _current.set(current)
+    return current
+
+
+def end_span(current):
+    if current is NOOP_SPAN:
+        return
+    _current.reset(current.token)
+    current.end_ns = time.time_ns()
+    _exporter.export(current)
+
+
+def init_app(app):
+    """Trace every HTTP request as a root span"""
+    global _exporter
+    app.config.setdefault('TRACING', False)
+    app.config.setdefault('TRACE_FILE', os.path.join(app.instance_path, 'traces.jsonl'))
+    app.config.setdefault('TRACE_MAX_MB', 100)
+    if not app.config['TRACING']:
+        return
+    if _exporter is None:
+        _exporter = FileExporter(app.config['TRACE_FILE'], app.config['TRACE_MAX_MB'] * 1024 * 1024)
+
+    from flask import request
+
+    @app.before_request
+    def _start_request_span():
+        if request.endpoint == 'static':
+            return
+        route = request.url_rule.rule if request.url_rule else request.path
+        request.environ['trace_span'] = start_span(
+            f'{request.method} {route}', parent=None, kind=KIND_SERVER,
+            **{'http.request.method': request.method, 'http.route': route, 'url.path': request.path}
+        )
+
+    @app.after_request
+    def _tag_request_span(response):
+        current = request.environ.get('trace_span')
+        if current is not None:
+            current.set_attribute('http.response.status_code', response.status_code)
+            if response.status_code >= 500:
+                current.set_error(f'HTTP {response.status_code}')
+        return response
+
+    @app.teardown_request
+    def _end_request_span(exc):
+        current = request.environ.pop('trace_span', None)
+        if current is not None:
+            if exc is not None:
+                current.record_exception(exc)
+            end_span(current)
+
+
+def summarize(path, limit=20):
+    """Print the slowest traces in `path` as indented span trees"""
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    spans.extend(scope['spans'])
+    children = {}
+    for item in spans:
+        children.setdefault(item.get('parentSpanId'), []).append(item)
+    roots = sorted(children.get(None, []),
+                   key=lambda item: int(item['endTimeUnixNano']) - int(item['startTimeUnixNano']),
+                   reverse=True)
+
+    def show(item, depth):
+        duration = (int(item['endTimeUnixNano']) - int(item['startTimeUnixNano'])) / 1e6
+        attributes = ' '.join(f"{a['key']}={next(iter(a['value'].values()))}" for a in item['attributes'])
+        error = ' ❌' if item['status'].get('code') == STATUS_ERROR else ''
+        print(f"{'  ' * depth}{duration:9.1f}ms  {item['name']}{error}  {attributes}")
+        for child in sorted(children.get(item['spanId'], []), key=lambda c: int(c['startTimeUnixNano'])):
+            show(child, depth + 1)
+
+    for root in roots[:limit]:
+        show(root, 0)
+        print()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='按耗时列出最慢的调用链')
+    parser.add_argument('file', nargs='?', default=os.path.join('instance', 'traces.jsonl'))
+    parser.add_argument('--limit', type=int, default=20, help='最多显示多少条调用链')
+    args = parser.parse_args()
+    summarize(args.file, args.limit)
@@ -0,0 +1,179 @@
+"""In-process cache of user profile blocks (id, name, avatar).
+
+Serializers read publisher, comment author and message sender details from
+here instead of joining ``user`` into every list query. Missing profiles are
+loaded in one query per call, so a page needs at most one lookup when the
+cache is cold and none afterwards.
+
+Entries are keyed by couple (see tenancy.py) and user id. Inserting, updating
+or deleting a User through the ORM invalidates its entry once the session
+commits; ``USER_CACHE_TTL`` seconds bounds how long a change made outside
+this process (another worker, a bulk UPDATE, the sqlite shell) can go unseen.
+At most ``USER_CACHE_SIZE`` entries are kept, least recently used first out.
+Ids that match no user (a deleted sender, a forged id) are remembered as
+unknown for ``USER_CACHE_NEGATIVE_TTL`` seconds so they don't cost a query
+on every page.
+``USER_CACHE=0`` disables the cache; profiles are then only remembered for
+the current request or job.
+
+List endpoints accept ``?users=1`` to return a de-duplicated ``users`` map
+next to the rows, which then only carry the user id (see profile_map()).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import fragment_cache
+import metrics
+import tenancy
+from extensions import db
+from models import User
+
+_listening = False
+
+
+class UserCache:
+    def __init__(self, ttl, max_entries, negative_ttl):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, couple_id, user_ids):
+        """(cached profiles by id, ids that have to be loaded)
+
+        Ids recently looked up without finding a user are in neither.
+        """
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                key = (couple_id, user_id)
+                entry = self._entries.get(key)
+                if entry is None or entry[1] <= now:
+                    if entry is not None:
+                        del self._entries[key]
+                    missing.append(user_id)
+                    continue
+                self._entries.move_to_end(key)
+                if entry[0] is not None:
+                    found[user_id] = entry[0]
+        return found, missing
+
+    def set_many(self, couple_id, profiles, unknown=()):
+        """Store loaded profiles, and remember `unknown` ids for ``negative_ttl`` seconds"""
+        now = time.monotonic()
+        with self._lock:
+            for user_id, profile in profiles.items():
+                self._put((couple_id, user_id), (profile, now + self.ttl))
+            for user_id in unknown:
+                self._put((couple_id, user_id), (None, now + self.negative_ttl))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _load(user_ids):
+    rows = db.session.query(User.id, User.name, User.avatar).filter(User.id.in_(user_ids))
+    return {row.id: {'id': row.id, 'name': row.name, 'avatar': row.avatar} for row in rows}
+
+
+def profiles(user_ids):
+    """Profiles of `user_ids` by id; ids without a user are left out"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return {}
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        return _request_profiles(user_ids)
+    couple_id = tenancy.current_couple_id()
+    found, missing = cache.get_many(couple_id, user_ids)
+    metrics.USER_PROFILE_LOOKUPS.inc('hit', amount=len(found))
+    if missing:
+        metrics.USER_PROFILE_LOOKUPS.inc('miss', amount=len(missing))
+        loaded = _load(missing)
+        cache.set_many(couple_id, loaded, unknown=[user_id for user_id in missing if user_id not in loaded])
+        found.update(loaded)
+    return found
+
+
+def _request_profiles(user_ids):
+    known = g.setdefault('user_profiles', {})
+    missing = [user_id for user_id in user_ids if user_id not in known]
+    if missing:
+        loaded = _load(missing)
+        known.update({user_id: loaded.get(user_id) for user_id in missing})
+    return {user_id: known[user_id] for user_id in user_ids if known[user_id] is not None}
+
+
+def profile(user_id):
+    """Profile dict of one user, or None"""
+    return profiles((user_id,)).get(user_id)
+
+
+def wants_map():
+    return request.args.get('users', type=int) == 1
+
+
+def profile_map(user_ids):
+    """The ``users`` map of a response: profiles keyed by id"""
+    return {str(user_id): value for user_id, value in profiles(user_ids).items()}
+
+
+def _mark_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None and target.id is not None:
+        session.info.setdefault('changed_users', set()).add((tenancy.current_couple_id(), target.id))
+
+
+def _after_commit(session):
+    changed = session.info.pop('changed_users', None)
+    if changed:
+        cache = current_app.extensions.get('user_cache')
+        if cache is not None:
+            cache.invalidate(changed)
+        # the home page's pinned moments embed the author's name and avatar
+        fragment_cache.bump('pinned_moments', couples={couple_id for couple_id, _ in changed})
+
+
+def _after_rollback(session):
+    session.info.pop('changed_users', None)
+
+
+def init_app(app):
+    global _listening
+    app.config.setdefault('USER_CACHE', True)
+    app.config.setdefault('USER_CACHE_TTL', 300)
+    app.config.setdefault('USER_CACHE_SIZE', 10000)
+    app.config.setdefault('USER_CACHE_NEGATIVE_TTL', 30)
+    if app.config['USER_CACHE']:
+        app.extensions['user_cache'] = UserCache(
+            app.config['USER_CACHE_TTL'],
+            app.config['USER_CACHE_SIZE'],
+            app.config['USER_CACHE_NEGATIVE_TTL'],
+        )
+
+    # registered even without the cache: user changes also invalidate template fragments
+    if not _listening:
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(User, name, _mark_changed)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+        _listening = True
@@ -0,0 +1,1181 @@
+"""HTTP routes, Socket.IO handlers and the daily broadcast scheduler"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, date
+from functools import wraps
+
+from flask import (Blueprint, current_app, render_template, request, redirect, url_for, session,
+                   Response, stream_with_context)
+from flask_socketio import emit, join_room
+from sqlalchemy import extract, func
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+import data_export
+import fragment_cache
+import message_archive
+import metrics
+import rate_limit
+import tenancy
+import tracing
+import user_cache
+from ai_service import LoveOneDayService
+from extensions import db, socketio
+from instrumentation import track_socket_event
+from models import User, Anniversary, Moment, Comment, Like, Message, ArchivedMessage, LoveOneDayReport
+
+bp = Blueprint('main', __name__)
+
+# Authentication Functions and Decorators
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = session.get('token')
+        
+        # Check if it's an API request (returns JSON)
+        is_api_request = request.path.startswith('/api/')
+        
+        if not token or not validate_token(token):
+            if is_api_request:
+                # For API requests, return JSON error
+                return {'code': 401, 'msg': 'Authentication required'}, 401
+            else:
+                # For page requests, redirect to login
+                return redirect(url_for('main.login'))
+        
+        return f(*args, **kwargs)
+    return decorated_function
+
+def validate_token(token):
+    # the session's couple must still own the token before its shard is queried
+    if not tenancy.token_matches_couple(token):
+        return False
+    user = User.query.filter_by(token=token).first()
+    return user is not None
+
+def get_current_user():
+    token = session.get('token')
+    if token:
+        return User.query.filter_by(token=token).first()
+    return None
+
+# Anniversary bookkeeping: next_occurrence is refreshed at most once per day
+# and the total count is cached until an anniversary is added or deleted.
+# The state lives on the app, per couple, so separate app instances and
+# couples don't share it.
+def _anniversary_state():
+    states = current_app.extensions.setdefault('anniversary_state', {})
+    return states.setdefault(tenancy.current_couple_id(), {'refreshed_on': None, 'count': None})
+
+def refresh_anniversary_occurrences(today=None):
+    """Roll next_occurrence forward for anniversaries that have already passed"""
+    state = _anniversary_state()
+    today = today or date.today()
+    if state['refreshed_on'] == today:
+        return
+    stale = Anniversary.query.filter(
+        db.or_(Anniversary.next_occurrence < today, Anniversary.next_occurrence.is_(None))
+    ).all()
+    for anniversary in stale:
+        anniversary.next_occurrence = Anniversary.compute_next_occurrence(anniversary.date, today)
+    if stale:
+        db.session.commit()
+    state['refreshed_on'] = today
+
+def get_anniversary_count():
+    state = _anniversary_state()
+    if state['count'] is None:
+        state['count'] = Anniversary.query.count()
+    return state['count']
+
+def invalidate_anniversary_count():
+    """Drop the cached count and the home-page anniversary fragment"""
+    _anniversary_state()['count'] = None
+    fragment_cache.bump('anniversaries')
+
+def insert_ignoring_conflicts(model, **values):
+    """INSERT that silently skips a row violating a unique constraint"""
+    table = model.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        db.session.execute(insert(table).values(**values).on_conflict_do_nothing())
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        db.session.execute(insert(table).values(**values).on_conflict_do_nothing())
+    elif dialect in ('mysql', 'mariadb'):
+        db.session.execute(db.insert(table).values(**values).prefix_with('IGNORE'))
+    else:
+        # Any other backend: a plain INSERT in a SAVEPOINT, so a conflict only
+        # rolls back this statement and not the caller's transaction
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(table).values(**values))
+        except IntegrityError:
+            pass
+
+# Bulk list helpers: list endpoints project only the columns they serialize
+# (plain row tuples, no identity map) and can stream rows as NDJSON.
+STREAM_BATCH_SIZE = 500
+
+def wants_stream():
+    return request.args.get('stream') == 'ndjson'
+
+def stream_ndjson(query, serialize):
+    """Stream query rows as NDJSON while they come off the cursor"""
+    dumps = current_app.json.dumps
+
+    def generate():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield dumps(serialize(row)) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def serialize_anniversary_row(row, today):
+    return {
+        'id': row.id,
+        'title': row.title,
+        'date': row.date,
+        'days_count': (today - row.date).days
+    }
+
+def moment_feed_query():
+    """Column-only feed query: moment and like/comment counts in one statement; the
+    publisher comes from user_cache"""
+    like_count = db.select(func.count(Like.id)).where(
+        Like.moment_id == Moment.id
+    ).correlate(Moment).scalar_subquery()
+    comment_count = db.select(func.count(Comment.id)).where(
+        Comment.moment_id == Moment.id
+    ).correlate(Moment).scalar_subquery()
+    return db.session.query(
+        Moment.id, Moment.content, Moment.images_json, Moment.is_pinned, Moment.timestamp,
+        Moment.user_id.label('publisher_id'),
+        like_count.label('like_count'), comment_count.label('comment_count')
+    )
+
+def publisher_block(user_id):
+    profile = user_cache.profile(user_id) or {}
+    return {
+        'id': user_id,
+        'name': profile.get('name') or 'Unknown User',
+        'avatar': profile.get('avatar') or '/static/avatars/default.png'
+    }
+
+def serialize_moment_row(row, embed_users=True):
+    item = {
+        'id': row.id,
+        'content': row.content,
+        'images': json.loads(row.images_json or '[]'),
+        'is_pinned': row.is_pinned,
+        'created_at': row.timestamp,
+        'stats': {
+            'likes': row.like_count,
+            'comments': row.comment_count
+        },
+    }
+    if embed_users:
+        item['publisher'] = publisher_block(row.publisher_id)
+    else:
+        item['publisher_id'] = row.publisher_id
+    return item
+
+def comment_query():
+    """Column-only comment query; the author comes from user_cache"""
+    return db.session.query(
+        Comment.id, Comment.content, Comment.timestamp, Comment.moment_id, Comment.user_id
+    )
+
+def comment_author_block(user_id):
+    profile = user_cache.profile(user_id) or {}
+    return {
+        'id': user_id,
+        'name': profile.get('name'),
+        'avatar': profile.get('avatar')
+    }
+
+def serialize_comment_row(row, embed_users=True):
+    item = {
+        'id': row.id,
+        'content': row.content,
+        'timestamp': row.timestamp
+    }
+    if embed_users:
+        item['user'] = comment_author_block(row.user_id)
+    else:
+        item['user_id'] = row.user_id
+    return item
+
+def emit_feed_event(event, payload):
+    """Push a feed change to every open page so it can patch its list in place"""
+    socketio.emit(event, payload, room=tenancy.couple_room())
+
+MAX_EMBEDDED_COMMENTS = 20
+
+def latest_comments_by_moment(moment_ids, limit, embed_users=True):
+    """Latest `limit` comments of each moment (oldest first), one windowed query for all ids"""
+    if not moment_ids or limit <= 0:
+        return {}
+    rank = func.row_number().over(
+        partition_by=Comment.moment_id,
+        order_by=(Comment.timestamp.desc(), Comment.id.desc())
+    ).label('rank')
+    ranked = db.select(Comment.id, rank).where(Comment.moment_id.in_(moment_ids)).subquery()
+    rows = comment_query().join(ranked, ranked.c.id == Comment.id)\
+        .filter(ranked.c.rank <= limit)\
+        .order_by(Comment.moment_id, Comment.timestamp, Comment.id).all()
+    if embed_users:
+        user_cache.profiles(row.user_id for row in rows)
+    comments = {}
+    for row in rows:
+        comments.setdefault(row.moment_id, []).append(serialize_comment_row(row, embed_users))
+    return comments
+
+def serialize_report_row(row):
+    return {
+        'id': row.id,
+        'text': row.content,
+        'date': row.report_date.strftime('%Y年%m月%d日'),
+        'broadcast_type': row.broadcast_type,
+        'audio_url': row.audio_url,
+        'created_at': row.created_at,
+        'is_pushed': row.is_pushed
+    }
+
+def serialize_report_summary(row):
+    return {
+        'id': row.id,
+        'date': row.report_date.strftime('%Y年%m月%d日'),
+        'broadcast_type': row.broadcast_type,
+        'preview': row.preview,
+        'has_audio': bool(row.has_audio),
+        'is_pushed': row.is_pushed
+    }
+
+def parse_month(value):
+    """[first day, first day of the next month) of a 'YYYY-MM' string"""
+    start = datetime.strptime(value, '%Y-%m').date()
+    return start, date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+# Routes
+@bp.route('/')
+@login_required
+def index():
+    # The anniversary and pinned-moment blocks are cached template fragments
+    # (see fragment_cache.py); the queries are passed unevaluated so they only
+    # run when a fragment has to be rendered.
+    today = date.today()
+    refresh_anniversary_occurrences(today)
+    # Only the 2 most important anniversaries (the next ones to recur)
+    important_anniversaries = Anniversary.query.filter(
+        Anniversary.next_occurrence >= today
+    ).order_by(Anniversary.next_occurrence, Anniversary.id).limit(2)
+    
+    # Pinned moments of the current user (max 3)
+    user_id = session.get('user_id')
+    if user_id is None:
+        current_user = get_current_user()
+        user_id = current_user.id if current_user else None
+    pinned_moments = Moment.query.options(db.joinedload(Moment.user)).filter_by(
+        user_id=user_id, 
+        is_pinned=True
+    ).order_by(Moment.timestamp.desc()).limit(3)
+    
+    return render_template('index.html', 
+                      anniversaries=important_anniversaries, 
+                      total_count=get_anniversary_count(),
+                      pinned_moments=pinned_moments,
+                      user_id=user_id)
+
+@bp.route('/api/anniversaries')
+@login_required
+def get_anniversaries():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 5, type=int)
+    order = request.args.get('order', 'desc')
+    
+    today = date.today()
+    
+    query = db.session.query(Anniversary.id, Anniversary.title, Anniversary.date)
+    if order == 'asc':
+        query = query.order_by(Anniversary.id.asc())
+    else:
+        query = query.order_by(Anniversary.id.desc())
+    
+    if wants_stream():
+        return stream_ndjson(query, lambda row: serialize_anniversary_row(row, today))
+        
+    if per_page == -1:
+        # Fetch all items for frontend pagination
+        items = [serialize_anniversary_row(row, today) for row in query]
+        
+        return {
+            'items': items,
+            'total_count': len(items)
+        }
+    else:
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        
+        items = [serialize_anniversary_row(row, today) for row in pagination.items]
+        
+        return {
+            'items': items,
+            'has_next': pagination.has_next,
+            'has_prev': pagination.has_prev,
+            'current_page': page,
+            'total_pages': pagination.pages
+        }
+
+@bp.route('/anniversaries/add', methods=['POST'])
+def add_anniversary():
+    title = request.form.get('title')
+    date_str = request.form.get('date')
+    if title and date_str:
+        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+        new_anniversary = Anniversary(title=title, date=date_obj)
+        db.session.add(new_anniversary)
+        db.session.commit()
+        invalidate_anniversary_count()
+    return redirect(url_for('main.index'))
+
+@bp.route('/anniversaries')
+@login_required
+def anniversaries():
+    return render_template('anniversaries.html')
+
+@bp.route('/anniversaries/delete/<int:id>')
+@login_required
+def delete_anniversary(id):
+    anniversary = Anniversary.query.get_or_404(id)
+    db.session.delete(anniversary)
+    db.session.commit()
+    invalidate_anniversary_count()
+    return redirect(url_for('main.index'))
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        token = request.form.get('token')
+        couple_id = tenancy.couple_for_token(token)
+        if tenancy.is_enabled() and couple_id is None:
+            return render_template('login.html', error='Invalid token')
+        tenancy.select_couple(couple_id)
+        user = User.query.filter_by(token=token).first()
+        if user:
+            session['token'] = token
+            session['user_id'] = user.id
+            session['couple_id'] = couple_id
+            return redirect(url_for('main.index'))
+        else:
+            return render_template('login.html', error='Invalid token')
+    return render_template('login.html')
+
+@bp.route('/logout')
+def logout():
+    session.clear()
+    return redirect(url_for('main.login'))
+
+# Additional API endpoints for authentication
+@bp.route('/api/user/info')
+@login_required
+def user_info():
+    """Get current user info"""
+    user = get_current_user()
+    if user:
+        return {
+            'code': 200,
+            'msg': 'success',
+            'data': {
+                'id': user.id,
+                'name': user.name,
+                'avatar': user.avatar,
+                'role': user.role
+            }
+        }
+    else:
+        return {'code': 401, 'msg': 'User not found'}, 401
+
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+@bp.route('/moments')
+@login_required
+def moments():
+    # Render the moments page. The actual data loading will be done via AJAX to /api/moments
+    return render_template('moments.html')
+
+@bp.route('/api/moments')
+@login_required
+def get_moments():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    user_id = request.args.get('user_id', type=int)
+    keyword = request.args.get('keyword', type=str)
+    mode = request.args.get('mode', 'fuzzy')
+    # 每条动态附带最新的 N 条评论（0 表示不附带）
+    embed_comments = min(request.args.get('comments', 0, type=int), MAX_EMBEDDED_COMMENTS)
+    # users=1：用户信息放进去重的 data.users，条目里只保留 publisher_id / user_id
+    embed_users = not user_cache.wants_map()
+    
+    # 只查询需要的列；发布者信息取自 user_cache
+    query = moment_feed_query().order_by(Moment.is_pinned.desc(), Moment.timestamp.desc())
+    
+    if user_id:
+        query = query.filter(Moment.user_id == user_id)
+    
+    if keyword:
+        if mode == 'exact':
+             query = query.filter(Moment.content == keyword)
+        else:
+             query = query.filter(Moment.content.like(f'%{keyword}%'))
+
+    if wants_stream():
+        return stream_ndjson(query, serialize_moment_row)
+
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    
+    user_ids = {row.publisher_id for row in pagination.items}
+    # one lookup for every publisher on the page
+    user_cache.profiles(user_ids)
+    items = [serialize_moment_row(row, embed_users) for row in pagination.items]
+    if embed_comments > 0:
+        latest = latest_comments_by_moment([item['id'] for item in items], embed_comments, embed_users)
+        for item in items:
+            item['latest_comments'] = latest.get(item['id'], [])
+    
+    data = {
+        'items': items,
+        'pagination': {
+            'current_page': page,
+            'total_pages': pagination.pages,
+            'total_items': pagination.total,
+            'has_next': pagination.has_next,
+            'has_prev': pagination.has_prev
+        }
+    }
+    if not embed_users:
+        user_ids.update(comment['user_id'] for item in items for comment in item.get('latest_comments', ()))
+        data['users'] = user_cache.profile_map(user_ids)
+    return {
+        'code': 200,
+        'msg': 'success',
+        'data': data
+    }
+
+@bp.route('/moments/add', methods=['POST'])
+@login_required
+def add_moment():
+    content = request.form.get('content')
+    # 从当前会话获取用户身份，不再接受前端传递的user_id
+    current_user = get_current_user()
+    if not current_user:
+        return {'code': 401, 'msg': 'Authentication required'}, 401
+    
+    if not content:
+        return {'code': 400, 'msg': 'Content is required'}, 400
+        
+    image_paths = []
+    if 'images' in request.files:
+        files = request.files.getlist('images')
+        for file in files:
+            if file and allowed_file(file.filename):
+                filename = secure_filename(file.filename)
+                # Add timestamp to filename to avoid collision
+                timestamp_str = datetime.now().strftime('%Y%m%d%H%M%S')
+                filename = f"{timestamp_str}_{filename}"
+                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+                image_paths.append(f"/static/uploads/{filename}")
+    
+    moment = Moment(content=content, user_id=current_user.id)
+    moment.images = image_paths
+    
+    db.session.add(moment)
+    db.session.commit()
+    
+    emit_feed_event('moment_created', {
+        'moment': serialize_moment_row(moment_feed_query().filter(Moment.id == moment.id).one())
+    })
+    return redirect(url_for('main.moments'))
+
+@bp.route('/moments/<int:id>/delete', methods=['POST'])
+@login_required
+def delete_moment(id):
+    moment = Moment.query.get_or_404(id)
+    current_user = get_current_user()
+    if not current_user:
+        return {'code': 401, 'msg': 'Authentication required'}, 401
+    
+    # Only allow the publisher to delete their own moment
+    if moment.user_id != current_user.id:
+        return {'code': 403, 'msg': 'Permission denied'}, 403
+    
+    was_pinned = moment.is_pinned
+    db.session.delete(moment)
+    db.session.commit()
+    if was_pinned:
+        fragment_cache.bump('pinned_moments')
+    emit_feed_event('moment_deleted', {'moment_id': id})
+    return {'code': 200, 'msg': 'success'}
+
+@bp.route('/moments/<int:id>/pin', methods=['POST'])
+@login_required
+def pin_moment(id):
+    moment = Moment.query.get_or_404(id)
+    current_user = get_current_user()
+    if not current_user:
+        return {'code': 401, 'msg': 'Authentication required'}, 401
+    
+    # Only allow the publisher to pin their own moment
+    if moment.user_id != current_user.id:
+        return {'code': 403, 'msg': 'Permission denied'}, 403
+    
+    # Check if already pinned
+    if moment.is_pinned:
+        return {'code': 400, 'msg': 'Already pinned'}, 400
+    
+    # Check pinned count limit (max 3)
+    pinned_count = Moment.query.filter_by(user_id=current_user.id, is_pinned=True).count()
+    if pinned_count >= 3:
+        return {'code': 400, 'msg': '最多只能置顶3条日常'}, 400
+    
+    moment.is_pinned = True
+    db.session.commit()
+    fragment_cache.bump('pinned_moments')
+    emit_feed_event('moment_pinned', {'moment_id': id, 'user_id': current_user.id})
+    return {'code': 200, 'msg': 'success'}
+
+@bp.route('/moments/<int:id>/unpin', methods=['POST'])
+@login_required
+def unpin_moment(id):
+    moment = Moment.query.get_or_404(id)
+    current_user = get_current_user()
+    if not current_user:
+        return {'code': 401, 'msg': 'Authentication required'}, 401
+    
+    # Only allow the publisher to unpin their own moment
+    if moment.user_id != current_user.id:
+        return {'code': 403, 'msg': 'Permission denied'}, 403
+    
+    moment.is_pinned = False
+    db.session.commit()
+    fragment_cache.bump('pinned_moments')
+    emit_feed_event('moment_unpinned', {'moment_id': id, 'user_id': current_user.id})
+    return {'code': 200, 'msg': 'success'}
+
+@bp.route('/moments/<int:id>/like', methods=['POST'])
+@login_required
+def like_moment(id):
+    # 从当前会话获取用户身份
+    current_user = get_current_user()
+    if not current_user:
+        return {'code': 401, 'msg': 'Authentication required'}, 401
+    
+    if db.session.query(Moment.id).filter_by(id=id).scalar() is None:
+        return {'code': 404, 'msg': 'Moment not found'}, 404
+    
+    # Toggle without a read-then-write race: DELETE, and only if nothing was
+    # deleted INSERT with conflicts ignored (a concurrent tap already liked it).
+    deleted = db.session.execute(
+        db.delete(Like).where(Like.user_id == current_user.id, Like.moment_id == id)
+    ).rowcount
+    if deleted:
+        action = 'unliked'
+    else:
+        insert_ignoring_conflicts(Like, user_id=current_user.id, moment_id=id)
+        action = 'liked'
+    like_count = db.session.query(func.count(Like.id)).filter(Like.moment_id == id).scalar()
+    db.session.commit()
+    
+    emit_feed_event('moment_liked', {
+        'moment_id': id,
+        'user_id': current_user.id,
+        'action': action,
+        'likes': like_count
+    })
+    return {'code': 200, 'msg': 'success', 'action': action, 'likes': like_count}
+
+@bp.route('/moments/<int:id>/comment', methods=['POST'])
+@login_required
+def comment_moment(id):
+    content = request.json.get('content')
+    # 从当前会话获取用户身份
+    current_user = get_current_user()
+    if not current_user:
+        return {'code': 401, 'msg': 'Authentication required'}, 401
+    
+    if not content:
+         return {'code': 400, 'msg': 'Content is required'}, 400
+         
+    comment = Comment(content=content, user_id=current_user.id, moment_id=id)
+    db.session.add(comment)
+    db.session.commit()
+    
+    data = {
+        'id': comment.id,
+        'content': comment.content,
+        'user': comment_author_block(current_user.id),
+        'timestamp': comment.timestamp
+    }
+    comment_count = db.session.query(func.count(Comment.id)).filter(Comment.moment_id == id).scalar()
+    emit_feed_event('comment_added', {'moment_id': id, 'comment': data, 'comments': comment_count})
+    return {'code': 200, 'msg': 'success', 'data': data}
+
+@bp.route('/api/export')
+@login_required
+def export_archive():
+    """Full data export as a ZIP archive, streamed while it is generated"""
+    filename = f"love_plane_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
+    return Response(
+        stream_with_context(data_export.iter_archive(current_app._get_current_object())),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@bp.route('/api/moments/<int:id>/comments')
+@login_required
+def get_moment_comments(id):
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+    embed_users = not user_cache.wants_map()
+    
+    pagination = comment_query().filter(Comment.moment_id == id)\
+        .order_by(Comment.timestamp.asc())\
+        .paginate(page=page, per_page=per_page, error_out=False)
+    
+    user_ids = {row.user_id for row in pagination.items}
+    user_cache.profiles(user_ids)
+    items = [serialize_comment_row(row, embed_users) for row in pagination.items]
+    
+    data = {
+        'items': items,
+        'pagination': {
+            'current_page': page,
+            'total_pages': pagination.pages,
+            'total_items': pagination.total,
+            'has_next': pagination.has_next,
+            'has_prev': pagination.has_prev
+        }
+    }
+    if not embed_users:
+        data['users'] = user_cache.profile_map(user_ids)
+    return {
+        'code': 200, 
+        'msg': 'success', 
+        'data': data
+    }
+
+@bp.route('/chat')
+@login_required
+def chat():
+    return render_template('chat.html')
+
+def chat_history_query(model):
+    """Message columns for the hot or the archive table; senders come from user_cache"""
+    return db.session.query(model.id, model.sender_id, model.content, model.timestamp)
+
+def serialize_message_row(row, embed_users=True):
+    item = {
+        'id': row.id,
+        'sender_id': row.sender_id,
+        'content': row.content,
+        'timestamp': row.timestamp
+    }
+    if embed_users:
+        sender = user_cache.profile(row.sender_id) or {}
+        item['sender_name'] = sender.get('name')
+        item['sender_avatar'] = sender.get('avatar')
+    return item
+
+@bp.route('/api/chat/history')
+@login_required
+def get_chat_history():
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', 20, type=int)
+    embed_users = not user_cache.wants_map()
+    
+    # Both tables are paged by id, the before_id cursor, so a page that
+    # crosses from the hot table into the archive stays in order
+    query = chat_history_query(Message).order_by(Message.id.desc())
+    
+    if before_id:
+        query = query.filter(Message.id < before_id)
+        
+    # Return desc (newest first) as queried,
+    # and frontend handles display order (usually flex-direction: column-reverse or prepend).
+    rows = query.limit(limit).all()
+    
+    if len(rows) < limit:
+        # Paged back past the hot window: continue with the archived (older) messages
+        cursor = rows[-1].id if rows else before_id
+        archived = chat_history_query(ArchivedMessage).order_by(ArchivedMessage.id.desc())
+        if cursor:
+            archived = archived.filter(ArchivedMessage.id < cursor)
+        rows += archived.limit(limit - len(rows)).all()
+    
+    user_ids = {row.sender_id for row in rows}
+    user_cache.profiles(user_ids)
+    result = {
+        'items': [serialize_message_row(row, embed_users) for row in rows],
+        'has_more': len(rows) == limit
+    }
+    if not embed_users:
+        result['users'] = user_cache.profile_map(user_ids)
+    return result
+
+def authenticate_socketio():
+    """User id of the login behind a new Socket.IO connection, or None"""
+    token = session.get('token')
+    if not token or not tenancy.token_matches_couple(token):
+        return None
+    return db.session.query(User.id).filter_by(token=token).scalar()
+
+def socket_user_id():
+    """User authenticated when this socket connected (see on_connect)"""
+    return session.get('socket_user_id')
+
+def event_room(data):
+    """With tenancy on, events only ever go to the couple's own room"""
+    if tenancy.is_enabled():
+        return tenancy.couple_room()
+    return data.get('room', tenancy.DEFAULT_ROOM)
+
+# Socket.IO Events
+# Every socket gets its own copy of the login session. The user is resolved
+# once here and kept in it, so events read the sender from memory; a
+# client-supplied sender_id is ignored.
+@socketio.on('connect')
+@track_socket_event('connect')
+def on_connect(auth=None):
+    user_id = authenticate_socketio()
+    if user_id is None:
+        return False
+    session['socket_user_id'] = user_id
+    metrics.socket_connected(request.sid)
+
+@socketio.on('disconnect')
+def on_disconnect():
+    metrics.socket_disconnected(request.sid)
+
+@socketio.on('join')
+@track_socket_event('join')
+def on_join(data):
+    if socket_user_id() is None:
+        return False
+        
+    room = event_room(data)
+    join_room(room)
+    metrics.socket_joined(request.sid, room)
+    # emit('status', {'msg': 'Someone joined'}, room=room)
+
+@socketio.on('message')
+@track_socket_event('message')
+@rate_limit.socket_event('message')
+def on_message(data):
+    sender_id = socket_user_id()
+    if sender_id is None:
+        return False
+        
+    content = data.get('content')
+    room = event_room(data)
+    
+    if not content:
+        return
+    
+    # Save to DB; the payload is built after the flush (id and timestamp are
+    # set) so the commit doesn't cost a reload of the expired row
+    msg = Message(content=content, sender_id=sender_id)
+    db.session.add(msg)
+    db.session.flush()
+    
+    # Broadcast; the sender's name/avatar come from the profile cache
+    user = user_cache.profile(msg.sender_id)
+    payload = {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'content': msg.content,
+        'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'sender_name': user['name'] if user else 'Unknown',
+        'sender_avatar': user['avatar'] if user else ''
+    }
+    db.session.commit()
+    
+    emit('response', payload, room=room)
+
+@socketio.on('typing')
+@track_socket_event('typing')
+@rate_limit.socket_event('typing')
+def on_typing(data):
+    user_id = socket_user_id()
+    if user_id is None:
+        return False
+        
+    room = event_room(data)
+    emit('status_change', {'user_id': user_id, 'status': 'typing'}, room=room, include_self=False)
+
+@socketio.on('stop_typing')
+@track_socket_event('stop_typing')
+@rate_limit.socket_event('stop_typing')
+def on_stop_typing(data):
+    user_id = socket_user_id()
+    if user_id is None:
+        return False
+        
+    room = event_room(data)
+    emit('status_change', {'user_id': user_id, 'status': 'online'}, room=room, include_self=False)
+
+@socketio.on('recall')
+@track_socket_event('recall')
+@rate_limit.socket_event('recall')
+def on_recall(data):
+    user_id = socket_user_id()
+    if user_id is None:
+        return False
+        
+    msg_id = data.get('id')
+    room = event_room(data)
+    
+    # Only the sender's own messages; one DELETE instead of a SELECT first
+    deleted = db.session.execute(
+        db.delete(Message).where(Message.id == msg_id, Message.sender_id == user_id)
+    ).rowcount
+    db.session.commit()
+    if deleted:
+        emit('message_recalled', {'id': msg_id}, room=room)
+
+@bp.route('/love-one-day')
+@login_required
+def love_one_day():
+    return redirect(url_for('main.index'))
+
+@bp.route('/api/love-one-day/today', methods=['GET'])
+@login_required
+def get_today_love_one_day():
+    try:
+        today = date.today()
+        
+        with tracing.span('love_one_day.find_report', **{'report.date': today.isoformat()}) as span:
+            existing_report = LoveOneDayReport.query.filter_by(report_date=today).first()
+            span.set_attribute('found', existing_report is not None)
+            
+        if existing_report:
+            return {
+                'code': 200,
+                'msg': 'success',
+                'data': {
+                    'id': existing_report.id,
+                    'text': existing_report.content,
+                    'date': existing_report.report_date.strftime('%Y年%m月%d日'),
+                    'broadcast_type': existing_report.broadcast_type,
+                    'audio_url': existing_report.audio_url,
+                    'created_at': existing_report.created_at
+                }
+            }
+            
+        with rate_limit.work_slot('llm'):
+            data = LoveOneDayService.collect_daily_data()
+            report_text = LoveOneDayService.generate_love_broadcast(data)
+            
+        broadcast_type = LoveOneDayService.get_broadcast_type(data)
+            
+        with tracing.span('love_one_day.save_report', broadcast_type=broadcast_type):
+            new_report = LoveOneDayReport(
+                report_date=today,
+                content=report_text,
+                broadcast_type=broadcast_type
+            )
+            db.session.add(new_report)
+            db.session.commit()
+            
+        return {
+            'code': 200,
+            'msg': 'success',
+            'data': {
+                'id': new_report.id,
+                'text': new_report.content,
+                'date': new_report.report_date.strftime('%Y年%m月%d日'),
+                'broadcast_type': new_report.broadcast_type,
+                'audio_url': new_report.audio_url,
+                'created_at': new_report.created_at
+            }
+        }
+    except rate_limit.QueueFull:
+        return rate_limit.busy_response()
+    except Exception as e:
+        print(f"Error getting today's love one day report: {e}")
+        return {
+            'code': 500,
+            'msg': f'获取播报失败: {str(e)}'
+        }, 500
+
+@bp.route('/api/love-one-day/generate', methods=['POST'])
+@login_required
+@rate_limit.route('love_one_day_generate')
+def generate_love_one_day_report():
+    try:
+        today = date.today()
+        
+        with tracing.span('love_one_day.find_report', **{'report.date': today.isoformat()}) as span:
+            existing_report = LoveOneDayReport.query.filter_by(report_date=today).first()
+            span.set_attribute('found', existing_report is not None)
+            
+        if existing_report:
+            return {
+                'code': 200,
+                'msg': 'success',
+                'data': {
+                    'id': existing_report.id,
+                    'text': existing_report.content,
+                    'date': existing_report.report_date.strftime('%Y年%m月%d日'),
+                    'broadcast_type': existing_report.broadcast_type,
+                    'audio_url': existing_report.audio_url,
+                    'created_at': existing_report.created_at
+                }
+            }
+            
+        with rate_limit.work_slot('llm'):
+            data = LoveOneDayService.collect_daily_data()
+            report_text = LoveOneDayService.generate_love_broadcast(data)
+            
+        broadcast_type = LoveOneDayService.get_broadcast_type(data)
+            
+        with tracing.span('love_one_day.save_report', broadcast_type=broadcast_type):
+            new_report = LoveOneDayReport(
+                report_date=today,
+                content=report_text,
+                broadcast_type=broadcast_type
+            )
+            db.session.add(new_report)
+            db.session.commit()
+            
+        return {
+            'code': 200,
+            'msg': 'success',
+            'data': {
+                'id': new_report.id,
+                'text': new_report.content,
+                'date': new_report.report_date.strftime('%Y年%m月%d日'),
+                'broadcast_type': new_report.broadcast_type,
+                'audio_url': new_report.audio_url,
+                'created_at': new_report.created_at
+            }
+        }
+    except rate_limit.QueueFull:
+        return rate_limit.busy_response()
+    except Exception as e:
+        print(f"Error generating love one day report: {e}")
+        return {
+            'code': 500,
+            'msg': f'生成播报失败: {str(e)}'
+        }, 500
+
+@bp.route('/api/love-one-day/tts', methods=['POST'])
+@login_required
+@rate_limit.route('love_one_day_tts')
+def generate_love_one_day_tts():
+    text = request.json.get('text')
+    report_id = request.json.get('report_id')
+    if not text:
+        return {'code': 400, 'msg': 'Text is required'}, 400
+    
+    try:
+        reports_dir = os.path.join(current_app.root_path, 'static', 'reports')
+        os.makedirs(reports_dir, exist_ok=True)
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output_file = os.path.join(reports_dir, f'love_one_day_report_{timestamp}.mp3')
+        
+        with rate_limit.work_slot('tts'):
+            audio_file = LoveOneDayService.text_to_speech(text, output_file)
+        if audio_file:
+            rel_path = os.path.relpath(audio_file, current_app.root_path)
+            audio_url = '/' + rel_path.replace('\\', '/')
+            
+            if report_id:
+                with tracing.span('love_one_day.save_audio_url', **{'report.id': report_id}):
+                    report = LoveOneDayReport.query.get(report_id)
+                    if report:
+                        report.audio_url = audio_url
+                        db.session.commit()
+            
+            return {
+                'code': 200,
+                'msg': 'success',
+                'data': {
+                    'audio_url': audio_url
+                }
+            }
+        else:
+            return {
+                'code': 500,
+                'msg': '语音生成失败'
+            }, 500
+    except rate_limit.QueueFull:
+        return rate_limit.busy_response()
+    except Exception as e:
+        print(f"TTS Error: {e}")
+        return {
+            'code': 500,
+            'msg': f'语音生成失败: {str(e)}'
+        }, 500
+
+def push_daily_broadcast(today):
+    """Generate today's report for the current couple and push it to their room"""
+    existing_report = LoveOneDayReport.query.filter_by(report_date=today).first()
+    
+    if not existing_report:
+        data = LoveOneDayService.collect_daily_data()
+        report_text = LoveOneDayService.generate_love_broadcast(data)
+        
+        broadcast_type = LoveOneDayService.get_broadcast_type(data)
+        
+        with tracing.span('love_one_day.save_report', broadcast_type=broadcast_type):
+            new_report = LoveOneDayReport(
+                report_date=today,
+                content=report_text,
+                broadcast_type=broadcast_type,
+                is_pushed=True
+            )
+            db.session.add(new_report)
+            db.session.commit()
+        
+        print(f"✅ 爱的一天播报已生成: {report_text[:100]}...")
+        metrics.SCHEDULER_RUNS.inc('generated')
+        
+        socketio.emit('love_one_day_broadcast', {
+            'id': new_report.id,
+            'text': new_report.content,
+            'date': new_report.report_date.strftime('%Y年%m月%d日'),
+            'broadcast_type': new_report.broadcast_type
+        }, room=tenancy.couple_room())
+    else:
+        print(f"ℹ️ 今日播报已存在，跳过生成")
+        metrics.SCHEDULER_RUNS.inc('skipped')
+
+def schedule_daily_broadcast(app):
+    # Each job runs once per couple (tenancy.for_each_couple), spread over the tenant worker pool,
+    # and every run is its own trace
+    def broadcast_worker():
+        refreshed_on = None
+        while True:
+            now = datetime.now()
+            today = date.today()
+            
+            if refreshed_on != today:
+                with tracing.span('scheduler.refresh_anniversaries', parent=None):
+                    tenancy.for_each_couple(app, lambda couple_id: refresh_anniversary_occurrences(today),
+                                            '纪念日日期刷新')
+                refreshed_on = today
+            
+            if now.hour == 3 and now.minute == 0:
+                with tracing.span('scheduler.message_archive', parent=None):
+                    message_archive.run_scheduled(app)
+            
+            if now.hour == 6 and now.minute == 0:
+                print(f"⏰ 爱的一天定时推送: {now.strftime('%Y-%m-%d %H:%M:%S')}")
+                with tracing.span('scheduler.daily_broadcast', parent=None) as span:
+                    results = tenancy.for_each_couple(app, lambda couple_id: push_daily_broadcast(today),
+                                                      '爱的一天定时推送')
+                    span.set_attributes(couples=len(results), failed=results.count(False))
+                metrics.SCHEDULER_RUNS.inc('failed', amount=results.count(False))
+            
+            time.sleep(60)
+    
+    scheduler_thread = threading.Thread(target=broadcast_worker, daemon=True)
+    scheduler_thread.start()
+
+@bp.route('/api/love-one-day/history', methods=['GET'])
+@login_required
+def get_love_one_day_history():
+    # List rows carry the stored preview instead of the full text; the text and
+    # audio of one report come from get_love_one_day_report().
+    month = request.args.get('month', '', type=str)
+    try:
+        month_range = parse_month(month) if month else None
+    except ValueError:
+        return {'code': 400, 'msg': 'month must be YYYY-MM'}, 400
+    
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 10, type=int)
+        order = request.args.get('order', 'desc', type=str)
+        keyword = request.args.get('keyword', '', type=str)
+        
+        query = db.session.query(
+            LoveOneDayReport.id, LoveOneDayReport.report_date, LoveOneDayReport.broadcast_type,
+            LoveOneDayReport.preview, LoveOneDayReport.audio_url.isnot(None).label('has_audio'),
+            LoveOneDayReport.is_pushed
+        )
+        
+        if month_range:
+            query = query.filter(LoveOneDayReport.report_date >= month_range[0],
+                                 LoveOneDayReport.report_date < month_range[1])
+        
+        if keyword:
+            query = query.filter(LoveOneDayReport.content.contains(keyword))
+        
+        if order == 'asc':
+            query = query.order_by(LoveOneDayReport.report_date.asc())
+        else:
+            query = query.order_by(LoveOneDayReport.report_date.desc())
+        
+        if wants_stream():
+            return stream_ndjson(query, serialize_report_summary)
+        
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        
+        items = [serialize_report_summary(row) for row in pagination.items]
+        
+        return {
+            'code': 200,
+            'msg': 'success',
+            'data': {
+                'items': items,
+                'total': pagination.total,
+                'pagination': {
+                    'current_page': page,
+                    'total_pages': pagination.pages,
+                    'total_items': pagination.total,
+                    'has_next': pagination.has_next,
+                    'has_prev': pagination.has_prev
+                }
+            }
+        }
+    except Exception as e:
+        print(f"Error getting love one day history: {e}")
+        return {
+            'code': 500,
+            'msg': f'获取历史播报失败: {str(e)}'
+        }, 500
+
+@bp.route('/api/love-one-day/history/months', methods=['GET'])
+@login_required
+def get_love_one_day_history_months():
+    """Number of reports in each month, for jumping across months and years"""
+    order = request.args.get('order', 'desc', type=str)
+    # PostgreSQL's extract() returns numeric; cast so both come back as int
+    year = db.cast(extract('year', LoveOneDayReport.report_date), db.Integer)
+    month = db.cast(extract('month', LoveOneDayReport.report_date), db.Integer)
+    query = db.session.query(year.label('year'), month.label('month'), func.count(LoveOneDayReport.id))\
+        .group_by(year, month)
+    if order == 'asc':
+        query = query.order_by(year.asc(), month.asc())
+    else:
+        query = query.order_by(year.desc(), month.desc())
+    
+    return {
+        'code': 200,
+        'msg': 'success',
+        'data': {
+            'months': [{'month': f'{y:04d}-{m:02d}', 'count': count} for y, m, count in query]
+        }
+    }
+
+@bp.route('/api/love-one-day/reports/<int:id>', methods=['GET'])
+@login_required
+def get_love_one_day_report(id):
+    report = LoveOneDayReport.query.get(id)
+    if report is None:
+        return {'code': 404, 'msg': 'Report not found'}, 404
+    return {'code': 200, 'msg': 'success', 'data': serialize_report_row(report)}